@@ -0,0 +1,152 @@
+# Streaming JSON field extraction for responses too large to parse on the ESP32.
+# The response is read from the socket in fixed size chunks and walked byte by byte. Only the values of the
+# requested paths are kept, so peak memory is one chunk plus the requested values, whatever the response size.
+# Paths use dots for object keys and array indexes, e.g. 'main.temp' or 'weather.0.description'.
+# Only scalar values (strings, numbers, true, false, null) can be extracted.
+
+_WAIT = 0
+_STRING = 1
+_SCALAR = 2
+
+# Byte values as int tuples, MicroPython's bytes.__contains__ does not accept an int
+_WHITESPACE = (32, 9, 13, 10)
+_SCALAR_END = (44, 125, 93)
+_ESCAPES = {ord("n"): b"\n", ord("t"): b"\t", ord("r"): b"\r", ord("b"): b"\b", ord("f"): b"\f"}
+
+class JsonExtractor:
+
+    def __init__(self, paths, maxString=64):
+        self.wanted = {}
+        for path in paths:
+            self.wanted[path] = True
+        self.maxString = maxString
+        self.found = {}
+        self.done = False
+        # One [isObject, key or index] frame per open container
+        self.stack = []
+        self.state = _WAIT
+        self.expectKey = False
+        self.isKey = False
+        self.capture = False
+        self.escape = False
+        self.unicode = None
+        self.buf = bytearray()
+
+    def _path(self):
+        return ".".join([str(frame[1]) for frame in self.stack])
+
+    def _startValue(self):
+        self.capture = self._path() in self.wanted
+        self.buf = bytearray()
+
+    def _store(self, value):
+        self.found[self._path()] = value
+        if(len(self.found)==len(self.wanted)):
+            self.done = True
+
+    def _endScalar(self):
+        self.state = _WAIT
+        if(not self.capture):
+            return
+        text = bytes(self.buf).decode()
+        if(text=="true"):
+            value = True
+        elif(text=="false"):
+            value = False
+        elif(text=="null"):
+            value = None
+        elif("." in text or "e" in text or "E" in text):
+            value = float(text)
+        else:
+            value = int(text)
+        self._store(value)
+
+    def _endString(self):
+        self.state = _WAIT
+        if(self.isKey):
+            self.stack[-1][1] = bytes(self.buf).decode()
+            self.expectKey = False
+        elif(self.capture):
+            self._store(bytes(self.buf).decode())
+
+    def _append(self, data):
+        if(self.capture and len(self.buf)<self.maxString):
+            self.buf.extend(data)
+
+    # Method to parse the next chunk of the response. Stops early once every requested path has been found
+    def feed(self, chunk):
+        for byte in chunk:
+            if(self.done):
+                return
+            if(self.state==_STRING):
+                self._stringByte(byte)
+                continue
+            if(self.state==_SCALAR):
+                if(byte in _WHITESPACE or byte in _SCALAR_END):
+                    self._endScalar()
+                else:
+                    if(self.capture and len(self.buf)<self.maxString):
+                        self.buf.append(byte)
+                    continue
+            if(byte in _WHITESPACE or byte==ord(":")):
+                continue
+            if(byte==ord("{")):
+                self.stack.append([True, None])
+                self.expectKey = True
+            elif(byte==ord("[")):
+                self.stack.append([False, 0])
+            elif(byte==ord("}") or byte==ord("]")):
+                if(self.stack):
+                    self.stack.pop()
+                self.expectKey = False
+            elif(byte==ord(",")):
+                if(self.stack and not self.stack[-1][0]):
+                    self.stack[-1][1] = self.stack[-1][1]+1
+                else:
+                    self.expectKey = True
+            elif(byte==ord('"')):
+                self.state = _STRING
+                self.isKey = self.expectKey
+                if(self.isKey):
+                    self.capture = True
+                    self.buf = bytearray()
+                else:
+                    self._startValue()
+            else:
+                self.state = _SCALAR
+                self._startValue()
+                if(self.capture):
+                    self.buf.append(byte)
+
+    def _stringByte(self, byte):
+        if(self.unicode is not None):
+            self.unicode = self.unicode+chr(byte)
+            if(len(self.unicode)==4):
+                if(self.capture):
+                    code = int(self.unicode, 16)
+                    # Surrogate pairs are not joined, each half is kept as '?'
+                    self._append(b"?" if 0xD800<=code<=0xDFFF else chr(code).encode())
+                self.unicode = None
+        elif(self.escape):
+            self.escape = False
+            if(byte==ord("u")):
+                self.unicode = ""
+            else:
+                self._append(_ESCAPES.get(byte, bytes((byte,))))
+        elif(byte==ord("\\")):
+            self.escape = True
+        elif(byte==ord('"')):
+            self._endString()
+        elif(self.capture and len(self.buf)<self.maxString):
+            self.buf.append(byte)
+
+# Method to read JSON from a stream (e.g. a urequests response's .raw socket) and return {path: value} for the
+# requested paths that were found. Reading stops as soon as all of them have been seen
+def extract(stream, paths, chunkSize=128):
+    parser = JsonExtractor(paths)
+    while not parser.done:
+        chunk = stream.read(chunkSize)
+        if(not chunk):
+            break
+        parser.feed(chunk)
+    return parser.found
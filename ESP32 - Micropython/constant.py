@@ -3,11 +3,54 @@ WIFI_SSID = ''
 WIFI_PSD = ''
 BLYNK_AUTH = ''
 RELAYSTATEMSG = "Switching relay state for Virtual Pin: {} , ESP Digital Pin: {} to {}"
-EMAIL_API_KEY = ""
-IFTT_BASE_URL = "http://maker.ifttt.com/trigger/DHT22_TempTooHigh/with/key/"
-REQUEST_HEADERS = {'Content-Type': 'application/json'}
 OPENWEATHER_APPID = ""
 OPENWEATHER_CITYNAME = "navi%20mumbai"
 OPENWEATHER_BASE_API_URL = "http://api.openweathermap.org/data/2.5/weather?"
 WORLDTIMEAPI_URL = "http://worldtimeapi.org/api/timezone/Asia/Kolkata"
 PI_LOCAL_SERVER_URL = 'http://192.168.1.112:8000'
+DEVICE_ID = ''  # Name of this board on the PI server (letters, digits, '-' or '_', at most 32). Empty uses the chip's unique ID
+TIME_RESYNC_INTERVAL = 21600  # Seconds between RTC resyncs (from the PI, or WorldTimeAPI when the PI is unreachable), run as a background job
+RELAY_GPIO_PINS = (12, 13, 14, 15, 21, 23, 25, 26)  # ESP Digital Pin for relays on V0-V7, in virtual pin order
+SCENE_VPIN = 15  # Virtual pin receiving scene commands
+SCENESTATEMSG = "Switching relay scene. Relay mask: {} , Relay states: {}"
+SCENES = {
+    'all_off': (0b11111111, 0b00000000),
+    'all_on': (0b11111111, 0b11111111),
+}  # Named scenes as (mask, states). Bit n is relay Vn
+EVENT_BUFFER_SIZE = 32  # Events buffered for the PI server before a flush is forced
+EVENT_FLUSH_INTERVAL = 60  # Interval for sending buffered events to the PI server
+# Event codes sent to the PI /ingest endpoint. Must match EVENT_* in the PI server's config.py
+EVENT_BLYNK_CONNECTED = 0
+EVENT_BLYNK_DISCONNECTED = 1
+EVENT_RELAY = 2
+EVENT_RELAY_SCENE = 3
+EVENT_DHT_SUCCESS = 4
+EVENT_DHT_FAIL = 5
+EVENT_WEATHER_SUCCESS = 6
+EVENT_WEATHER_FAIL = 7
+EVENT_EMAIL_SUCCESS = 8  # Sent by firmware that still calls IFTTT itself, no longer used
+EVENT_EMAIL_FAIL = 9
+EVENT_DHT_SUMMARY = 10
+PI_SOCKET_TIMEOUT = 5  # Seconds to wait on the PI server connection before giving up on a report
+DHT_INTERVAL = 1800  # Seconds between DHT11 readings
+WEATHER_INTERVAL = 2700  # Seconds between OpenWeather updates
+BLYNK_RUN_INTERVAL_MS = 10  # Milliseconds the Blynk task sleeps between polls
+HTTP_TIMEOUT = 10  # Seconds an outbound HTTP request may block the network task
+RELAY_JOB_QUEUE_SIZE = 4  # Pending high priority network jobs (relay and urgent event reports)
+BACKGROUND_JOB_QUEUE_SIZE = 8  # Pending background network jobs (weather, time sync, heartbeat, periodic flush)
+JSON_CHUNK_SIZE = 128  # Bytes read from the socket at a time when extracting fields from API responses
+HEARTBEAT_INTERVAL = 300  # Seconds between health heartbeats sent to the PI server
+DHT_SAMPLING = True  # Sample the DHT11 every DHT_SAMPLE_INTERVAL and report summaries every DHT_INTERVAL, or False for one reading every DHT_INTERVAL
+DHT_SAMPLE_INTERVAL = 60  # Seconds between DHT11 samples in sampling mode (the sensor needs at least 1)
+DHT_WINDOW_SIZE = 30  # Samples kept for the rolling min/max/mean
+DHT_EWMA_ALPHA = 0.2  # Weight of the newest sample in the moving average
+DHT_TEMP_DEADBAND = 1.5  # A sample this many degrees away from the last reported temperature is reported immediately
+DHT_HUM_DEADBAND = 5  # Same for humidity, in %
+RELAY_RESTORE_AT_BOOT = True  # Switch the relays back to their last state, saved in flash, before Wi-Fi and Blynk come up
+RELAY_STATE_FILE = 'relays.dat'  # One byte in flash, bit n set when relay Vn is on
+WIFI_FAST_BOOT = True  # Join the access point cached in flash by BSSID without restarting Wi-Fi. False for the full restart, scan and connect
+WIFI_SCAN_AT_BOOT = False  # Scan and log nearby networks on every boot. A scan always runs when no access point is cached
+WIFI_CACHE_FILE = 'wifi.json'  # SSID, BSSID, channel and IP config of the last successful connection
+WIFI_STATIC_IP = ()  # (ip, subnet, gateway, dns) to skip DHCP, 'cached' to reuse the address of the last DHCP lease (only if the router reserves it), () for DHCP
+WIFI_CONNECT_TIMEOUT_MS = 5000  # Milliseconds to wait for each connect attempt
+WIFI_POLL_MS = 50  # Milliseconds between connection checks while connecting
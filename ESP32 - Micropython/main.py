@@ -9,105 +9,452 @@
 #   4. 25-Mar-2022 - Changed relay switching logic for easy debugging and reduced time complexity
 #   5. 25-Mar-2022 - Added functionality which sends GET to WorlTimeAPI to return current local time. ESP32 will still be able to get local time even when not connected to PC due to this addition.
 #   6. 26-Mar-2022 - Added an LED blink function for the on board LED to notify when ESP is connected and Blynk and registering Blynk events
+#   7. 18-Oct-2026 - RTC is set from WorldTimeAPI once at boot and resynced on a timer. Timestamps are read from the RTC without any network call
+#   8. 18-Oct-2026 - Relays are driven from a single pin table indexed by virtual pin. Added scene command to switch several relays with one Blynk event and one PI report
+#   9. 18-Oct-2026 - Events for the PI server are kept in a fixed size ring buffer and sent as one batch to /ingest on a timer or when the buffer is full
+#  10. 18-Oct-2026 - Reports to the PI server reuse one persistent HTTP/1.1 keep-alive connection which is reopened when the PI closes it
+#  11. 18-Oct-2026 - Main loop replaced by uasyncio tasks. Outbound HTTP runs one job at a time from bounded queues with timeouts, relay reports ahead of background work, so Blynk is serviced between requests
+#  12. 18-Oct-2026 - Weather and time are fetched from the PI server's caching gateway as small fixed layout payloads. OpenWeather and WorldTimeAPI are only called directly when the PI cannot be reached
+#  13. 18-Oct-2026 - Direct WorldTimeAPI and OpenWeather responses are read with the streaming JsonExtract module instead of response.json(), so only the needed fields are kept in memory
+#  14. 18-Oct-2026 - Added a health heartbeat to the PI server with free heap, fragmentation, loop and callback latency, Wi-Fi RSSI, reconnect and failed request counts
+#  15. 18-Oct-2026 - DHT11 is sampled every minute into a fixed size window with rolling min/max/mean/EWMA. Readings are reported when they leave a deadband, otherwise only as periodic summaries
+#  16. 18-Oct-2026 - High temperature email moved to the PI server's alert rules. The board no longer calls IFTTT itself
+#  17. 18-Oct-2026 - Every request to the PI server carries the board's device ID (constant.DEVICE_ID or the chip's unique ID) so several boards can share one PI
+#  18. 18-Oct-2026 - Fast boot. Relay states are kept in flash and restored before anything else, Wi-Fi reconnects to the access point cached in flash without a scan, time sync and fallback-only imports are deferred. Boot phase timings are logged and sent to the PI in the first heartbeat
 
 # Defects detected and needed to be worked on:
 #     1. Unable to handle https requests. ESP32 returns out of memory error when requests are made using https
 #     2. Need to fix project source code's time complexity and make it more memory efficient.
 #     3. Need to implement more exception handling to handle exceptions during runtime
+import time
+from machine import Pin
+
+import constant  #User defined constant module for delaring constants
+
+#Boot phases as (name, time.ticks_ms()). The tick counter starts at reset, so each entry is the time since power up
+bootPhases = []
+
+def bootPhase(name):
+    bootPhases.append((name, time.ticks_ms()))
+
+#Method to read the relay states saved in flash, bit n set when relay Vn was on
+def loadRelayStates():
+    try:
+        with open(constant.RELAY_STATE_FILE, 'rb') as stateFile:
+            return stateFile.read(1)[0]
+    except (OSError, IndexError):
+        return 0
+
+#Relays are switched back to their last state before anything else is imported or any network call is made, so after
+#a power blip they do not wait for Wi-Fi and Blynk. Relays are active low, so a relay that was on starts with its pin low
+relayStates = loadRelayStates() if constant.RELAY_RESTORE_AT_BOOT else 0
+savedRelayStates = relayStates
+
+# Relay Pin Mapping(V0-V7 in the below order). Index into relays is the virtual pin number
+relays = tuple(Pin(gpio, Pin.OUT, value=0 if relayStates & 1<<index else 1) for index, gpio in enumerate(constant.RELAY_GPIO_PINS))
+bootPhase('relays')
+
 import sys
+import os
+import gc
 import network
-import time
 import logging
 import dht
 import BlynkLib
-import urequests
-from BlynkTimer import BlynkTimer
-from machine import Pin
+import uasyncio as asyncio
+from machine import RTC, unique_id
+import ubinascii
+import esp32
 import socket
+import json
+from array import array
 
-import constant  #User defined constant module for delaring constants
-
-# Relay Pin Mapping(V0-V7 in the below order)
-relayD12 = Pin(12, Pin.OUT)
-relayD13 = Pin(13, Pin.OUT)
-relayD14 = Pin(14, Pin.OUT)
-relayD15 = Pin(15, Pin.OUT)
-relayD21 = Pin(21, Pin.OUT)
-relayD23 = Pin(23, Pin.OUT)
-relayD25 = Pin(25, Pin.OUT)
-relayD26 = Pin(26, Pin.OUT)
 connectBlynkLED = Pin(2, Pin.OUT)
 dht11 = dht.DHT11(Pin(4, Pin.IN, Pin.PULL_UP))
+rtc = RTC()
 
 #DECLARED VARIABLES
-timeout = 0
 T_VPIN = 3
 H_VPIN = 4
 
 openWeatherAPI = constant.OPENWEATHER_BASE_API_URL+"q="+constant.OPENWEATHER_CITYNAME+"&appid="+constant.OPENWEATHER_APPID
 connectBlynkLED.value(0)
 
-#Timer initialisation Events
-DHTSensortimer = BlynkTimer()
-OpenWeatherAPICall = BlynkTimer()
+#Bounded FIFO of outbound network jobs (functions taking no arguments). When it is full new jobs are refused and
+#counted instead of growing the heap
+class JobQueue:
+
+    def __init__(self, size):
+        self.size = size
+        self.jobs = []
+        self.dropped = 0
+
+    def put(self, job):
+        if(len(self.jobs)>=self.size):
+            self.dropped = self.dropped+1
+            return False
+        self.jobs.append(job)
+        jobReady.set()
+        return True
+
+#Network jobs for relay reports are always taken before background jobs (weather, time sync, heartbeat, periodic flush)
+jobReady = asyncio.Event()
+relayJobs = JobQueue(constant.RELAY_JOB_QUEUE_SIZE)
+backgroundJobs = JobQueue(constant.BACKGROUND_JOB_QUEUE_SIZE)
+flushQueued = False
+
+#Persistent HTTP/1.1 connection to the PI server built directly on a socket. The connection is kept open between
+#reports, and a request on a connection the PI has already closed is retried once on a fresh connection.
+#Every request carries the board's device ID so the PI keeps each board's state and log apart
+class PiClient:
+
+    def __init__(self, url, deviceId):
+        self.deviceId = deviceId
+        hostPort = url.split("://",1)[1].split("/",1)[0]
+        if(":" in hostPort):
+            self.host, port = hostPort.split(":",1)
+            self.port = int(port)
+        else:
+            self.host = hostPort
+            self.port = 80
+        self.address = None
+        self.sock = None
+        self.connectCount = 0
+        self.failCount = 0
+
+    def connect(self):
+        if(self.address is None):
+            self.address = socket.getaddrinfo(self.host, self.port)[0][-1]
+        sock = socket.socket()
+        sock.settimeout(constant.PI_SOCKET_TIMEOUT)
+        try:
+            sock.connect(self.address)
+        except:
+            sock.close()
+            raise
+        self.sock = sock
+        self.connectCount = self.connectCount+1
+
+    def close(self):
+        if(self.sock is not None):
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    #Method to send one request and return (status code, body bytes). Raises OSError if the PI cannot be reached
+    def request(self, path, body=b""):
+        try:
+            return self._request(path, body)
+        except OSError:
+            self.failCount = self.failCount+1
+            raise
+
+    def _request(self, path, body):
+        reused = self.sock is not None
+        if(not reused):
+            self.connect()
+        try:
+            return self._exchange(path, body)
+        except OSError:
+            self.close()
+            if(not reused):
+                raise
+        self.connect()
+        try:
+            return self._exchange(path, body)
+        except OSError:
+            self.close()
+            raise
+
+    def _exchange(self, path, body):
+        sock = self.sock
+        sock.write("GET {} HTTP/1.1\r\nHost: {}\r\nX-Device-ID: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(path, self.host, self.deviceId, len(body)).encode())
+        if(body):
+            sock.write(body)
+        statusLine = sock.readline()
+        if(not statusLine):
+            raise OSError("PI server closed the connection")
+        status = int(statusLine.split(None, 2)[1])
+        length = 0
+        keepAlive = True
+        while True:
+            line = sock.readline()
+            if(not line or line==b"\r\n"):
+                break
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if(name==b"content-length"):
+                length = int(value)
+            elif(name==b"connection" and value.strip().lower()==b"close"):
+                keepAlive = False
+        data = b""
+        while len(data)<length:
+            chunk = sock.read(length-len(data))
+            if(not chunk):
+                raise OSError("PI server closed the connection mid response")
+            data = data+chunk
+        if(not keepAlive):
+            self.close()
+        return status, data
+
+deviceId = constant.DEVICE_ID or ubinascii.hexlify(unique_id()).decode()
+piClient = PiClient(constant.PI_LOCAL_SERVER_URL, deviceId)
 
-#Method to curent current timestamp for logging and debugging
+#Ring buffer of events waiting to be sent to the PI server. Each slot holds (event code, time.ticks_ms(), data tuple)
+eventBuffer = [None]*constant.EVENT_BUFFER_SIZE
+eventHead = 0
+eventCount = 0
+eventsDropped = 0
+
+#Health counters reported in the heartbeat. callbackStats maps a name to [runs, total us, slowest us] since the last heartbeat
+callbackStats = {}
+blynkConnectCount = 0
+heartbeatSeq = 0
+bootReported = False
+
+def recordLatency(name, us):
+    stats = callbackStats.get(name)
+    if(stats is None):
+        stats = callbackStats[name] = [0, 0, 0]
+    stats[0] = stats[0]+1
+    stats[1] = stats[1]+us
+    if(us>stats[2]):
+        stats[2] = us
+
+#Decorator recording how long each run of a callback takes
+def timed(name):
+    def wrap(func):
+        def run(*args):
+            start = time.ticks_us()
+            try:
+                return func(*args)
+            finally:
+                recordLatency(name, time.ticks_diff(time.ticks_us(), start))
+        return run
+    return wrap
+
+#Method to get current timestamp from the RTC for logging and debugging. RTC is kept in local time by syncTime so no network call is needed
 def getTimeStamp():
     systime = time.localtime()
-    tstamp = str(systime[0])+"-"+str(systime[1])+"-"+str(systime[2])+" "+str(systime[3])+":"+str(systime[4])+":"+str(systime[5])+" "
-    return tstamp
-
-#Method to get timestamp from WorldTime API
-def getTimeFromAPI():
-    timeResponse=urequests.get(constant.WORLDTIMEAPI_URL)
-    if(timeResponse.status_code==200):
-        timeData=timeResponse.json()
-        dateTime=timeData['datetime']
-        dateTime=dateTime.replace("T"," ")
-        dateTime=dateTime.split(".",1)[0]+" "
-        return dateTime
-    else:
-        log.error("Sent GET request to WorldTimeAPI. Returned response with status code: {}".format(timeResponse.status_code))
-        return "**Time API Error**: "
+    return "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d} ".format(systime[0],systime[1],systime[2],systime[3],systime[4],systime[5])
+
+#Method to set the RTC from a 'YYYY-MM-DD?HH:MM:SS' string and a weekday counted from Monday=0
+def setRTC(dateTime, weekday):
+    rtc.datetime((int(dateTime[0:4]),int(dateTime[5:7]),int(dateTime[8:10]),weekday,int(dateTime[11:13]),int(dateTime[14:16]),int(dateTime[17:19]),0))
+
+#Method to set the RTC from the PI server's /time gateway, answered from the PI's own WorldTimeAPI synced clock as 'YYYY-MM-DD HH:MM:SS|weekday'
+def syncTimeFromPi():
+    try:
+        status, body = piClient.request('/time')
+    except OSError:
+        return False
+    if(status!=200):
+        return False
+    dateTime, weekday = body.decode().split("|")
+    setRTC(dateTime, int(weekday))
+    log.info(getTimeStamp()+"RTC synced with PI server")
+    return True
+
+#Method to set the RTC. Queued as a background job when the tasks start and then on a timer. The WorldTimeAPI
+#fallback is queued as a job of its own, so Blynk is serviced between the PI attempt and the API request
+def syncTime():
+    if(not syncTimeFromPi()):
+        backgroundJobs.put(syncTimeFromAPI)
+
+#Method to set the RTC directly from WorldTime API, used when the PI server cannot provide the time
+def syncTimeFromAPI():
+    import urequests
+    import JsonExtract  #Streaming JSON field extraction for API responses
+    try:
+        timeResponse=urequests.get(constant.WORLDTIMEAPI_URL,timeout=constant.HTTP_TIMEOUT)
+    except Exception as e:
+        log.error(getTimeStamp()+"Unable to reach WorldTimeAPI for time sync: {}".format(e))
+        return False
+    try:
+        if(timeResponse.status_code==200):
+            timeData=JsonExtract.extract(timeResponse.raw,('datetime','day_of_week'),constant.JSON_CHUNK_SIZE)
+            if(len(timeData)<2):
+                log.error(getTimeStamp()+"WorldTimeAPI response is missing datetime or day_of_week")
+                return False
+            dateTime=timeData['datetime']
+            # WorldTimeAPI counts weekdays from Sunday=0, the RTC from Monday=0
+            setRTC(dateTime, (timeData['day_of_week']+6)%7)
+            log.info(getTimeStamp()+"RTC synced with WorldTimeAPI")
+            return True
+        else:
+            log.error("Sent GET request to WorldTimeAPI. Returned response with status code: {}".format(timeResponse.status_code))
+            return False
+    finally:
+        timeResponse.close()
+
+async def restoreLED():
+    await asyncio.sleep_ms(100)
+    connectBlynkLED.value(1)
 
+#Method to blink the on board LED without blocking the Blynk callback it is called from
 def blinkLEDOnEvent():
     connectBlynkLED.value(0)
-    time.sleep(0.1)
-    connectBlynkLED.value(1)
+    asyncio.create_task(restoreLED())
+
+#Method to send every buffered event to the PI server as one /ingest request. Events are kept for the next attempt if the PI cannot be reached
+#or does not answer 200 (overloaded, device registry full, rejected batch); the ring buffer's drop-oldest rule still bounds them.
+#Each event is sent as [code, age in ms, data...] so the PI can timestamp it even when the RTC has not been synced
+def flushEvents():
+    global eventCount, eventsDropped, flushQueued
+    flushQueued = False
+    if(eventCount==0):
+        return True
+    now = time.ticks_ms()
+    start = (eventHead-eventCount)%constant.EVENT_BUFFER_SIZE
+    events = []
+    for i in range(eventCount):
+        code, ticks, data = eventBuffer[(start+i)%constant.EVENT_BUFFER_SIZE]
+        events.append([code, time.ticks_diff(now, ticks)]+list(data))
+    try:
+        ingest_json = {'events':events,'dropped':eventsDropped}
+        status, body = piClient.request('/ingest', json.dumps(ingest_json).encode())
+    except:
+        log.critical("Unable to communicate with Raspberry PI server. Please check this on priority")
+        return False
+    if(status!=200):
+        log.error(getTimeStamp()+"PI server answered /ingest with status code {}, keeping {} events for the next attempt".format(status, eventCount))
+        return False
+    log.info('Request to PI WebServer send')
+    for i in range(constant.EVENT_BUFFER_SIZE):
+        eventBuffer[i] = None
+    eventCount = 0
+    eventsDropped = 0
+    return True
+
+#Method to buffer an event for the PI server. When the buffer is full the oldest event is overwritten and counted as dropped.
+#Urgent events and a full buffer queue a flush on the relay job queue so it goes out ahead of background work
+def queueEvent(code, data=(), urgent=False):
+    global eventHead, eventCount, eventsDropped, flushQueued
+    eventBuffer[eventHead] = (code, time.ticks_ms(), data)
+    eventHead = (eventHead+1)%constant.EVENT_BUFFER_SIZE
+    if(eventCount<constant.EVENT_BUFFER_SIZE):
+        eventCount = eventCount+1
+    else:
+        eventsDropped = eventsDropped+1
+    if((urgent or eventCount==constant.EVENT_BUFFER_SIZE) and not flushQueued):
+        flushQueued = relayJobs.put(flushEvents)
 
 #Logging parameters
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("JACOB SMART HOME LOG")
 log.info(getTimeStamp()+"STARTING JACOB SMART HOME SCRIPT VERSION {}".format(constant.SCRIPT_VERSION))
 log.info(getTimeStamp()+"Logging started")
+log.info(getTimeStamp()+"Device ID: {}".format(deviceId))
 
 wifi = network.WLAN(network.STA_IF)
 
-#Restarting Wifi
-wifi.active(False)
-time.sleep(0.5)
-wifi.active(True)
+#Method to read the access point cached by the last successful connection to constant.WIFI_SSID as a dict
+#{ssid, bssid (hex), channel, ifconfig}, or None
+def loadWifiCache():
+    try:
+        with open(constant.WIFI_CACHE_FILE) as cacheFile:
+            cache = json.load(cacheFile)
+    except (OSError, ValueError):
+        return None
+    if(cache.get('ssid')!=constant.WIFI_SSID):
+        return None
+    return cache
+
+def saveWifiCache(cache):
+    try:
+        with open(constant.WIFI_CACHE_FILE, 'w') as cacheFile:
+            json.dump(cache, cacheFile)
+    except OSError as e:
+        log.error(getTimeStamp()+"Unable to save Wi-Fi cache: {}".format(e))
 
-#Scanning wifi available networks nearby
-networks = wifi.scan()
-logAvailableNetworks = 'Available Networks: ',networks
-log.info(logAvailableNetworks)
+#Method to pick the strongest access point for constant.WIFI_SSID from scan results, as (bssid, channel), or None
+def findAccessPoint(networks):
+    best = None
+    for ssid, bssid, channel, rssi, security, hidden in networks:
+        if(ssid.decode()==constant.WIFI_SSID and (best is None or rssi>best[2])):
+            best = (bssid, channel, rssi)
+    return best and best[:2]
 
-#Initialising connection to declared wifi network
-wifi.connect(constant.WIFI_SSID, constant.WIFI_PSD)
+#Method to wait for the Wi-Fi connection, polling every constant.WIFI_POLL_MS. Returns False after timeoutMs
+def waitForWifi(timeoutMs):
+    start = time.ticks_ms()
+    while(not wifi.isconnected()):
+        if(time.ticks_diff(time.ticks_ms(), start)>=timeoutMs):
+            return False
+        time.sleep_ms(constant.WIFI_POLL_MS)
+    return True
 
-#Starting timer to try connecting to network for 5 secs. If failed, then loop fails 
-if not wifi.isconnected():
+#Method to connect to constant.WIFI_SSID. With fast boot the interface is not restarted and the access point cached in
+#flash is joined directly by BSSID, without a scan. The cache is dropped and a normal connect made if it does not answer
+def connectWifi():
+    cache = loadWifiCache() if constant.WIFI_FAST_BOOT else None
+    if(not constant.WIFI_FAST_BOOT):
+        #Restarting Wifi
+        wifi.active(False)
+        time.sleep(0.5)
+    wifi.active(True)
+    accessPoint = None
+    if(constant.WIFI_SCAN_AT_BOOT or cache is None):
+        #Scanning wifi available networks nearby
+        networks = wifi.scan()
+        log.info(('Available Networks: ', networks))
+        accessPoint = findAccessPoint(networks)
+    staticIP = constant.WIFI_STATIC_IP
+    if(staticIP=='cached'):
+        staticIP = cache['ifconfig'] if cache is not None else ()
+    if(staticIP):
+        #Skips DHCP
+        wifi.ifconfig(tuple(staticIP))
     log.info(" Please wait while ESP32 is connecting to wifi..")
-    while(not wifi.isconnected() and timeout<5):
-        5-timeout
-        timeout = timeout+1
-        time.sleep(1)
-         
+    connected = False
+    if(cache is not None):
+        try:
+            #Firmware that cannot preset the station channel still joins by BSSID, after scanning the channels itself
+            wifi.config(channel=cache['channel'])
+        except (ValueError, OSError):
+            pass
+        wifi.connect(constant.WIFI_SSID, constant.WIFI_PSD, bssid=ubinascii.unhexlify(cache['bssid']))
+        connected = waitForWifi(constant.WIFI_CONNECT_TIMEOUT_MS)
+        if(not connected):
+            log.error(getTimeStamp()+"Cached access point did not answer, connecting without it")
+            wifi.disconnect()
+            cache = None
+            #The stale cache must not be tried again, even if this boot ends before it is rewritten
+            try:
+                os.remove(constant.WIFI_CACHE_FILE)
+            except OSError:
+                pass
+    if(not connected):
+        wifi.connect(constant.WIFI_SSID, constant.WIFI_PSD)
+        connected = waitForWifi(constant.WIFI_CONNECT_TIMEOUT_MS)
+    if(not connected):
+        if(constant.WIFI_FAST_BOOT):
+            #The next boot scans again
+            try:
+                os.remove(constant.WIFI_CACHE_FILE)
+            except OSError:
+                pass
+        return False
+    if(constant.WIFI_FAST_BOOT):
+        if(accessPoint is None and cache is None):
+            #Joined without the cache and without a boot scan, scan now so the cache is rewritten for the next boot
+            accessPoint = findAccessPoint(wifi.scan())
+        update = dict(cache) if cache is not None else {}
+        update['ssid'] = constant.WIFI_SSID
+        update['ifconfig'] = list(wifi.ifconfig())
+        if(accessPoint is not None):
+            update['bssid'] = ubinascii.hexlify(accessPoint[0]).decode()
+            update['channel'] = accessPoint[1]
+        if('bssid' in update and update!=cache):
+            saveWifiCache(update)
+    return True
 
-if wifi.isconnected():
+if connectWifi():
     wifiConnectedLog = 'Connection successful:', wifi.ifconfig()
     log.info(wifiConnectedLog)
+    bootPhase('wifi')
 
 else:
     log.error(getTimeStamp()+"Wifi Error: Connection Times Out!!!")
@@ -120,142 +467,153 @@ blynk = BlynkLib.Blynk(constant.BLYNK_AUTH)
 
 @blynk.on("connected")
 def blynk_connected(ping):
+    global blynkConnectCount
+    blynkConnectCount = blynkConnectCount+1
+    if(blynkConnectCount==1):
+        bootPhase('blynk')
+        logBootTimings()
     status= ("Blynk Connection Successful - Ping:", ping, "ms")
     connectBlynkLED.value(1)
     log.info(status)
     log.info(getTimeStamp()+"Syncing values for virtual pins from server...")
     blynk.sync_virtual(0,1,2,3,4,5,6,7)
     log.info(getTimeStamp()+"Syncing successful")
-    try:
-        pi_request=''
-        ping_json = {'ping_value':ping}
-        pi_request=urequests.get(constant.PI_LOCAL_SERVER_URL+'/blynk-connection',
-        json=ping_json,
-        headers=constant.REQUEST_HEADERS)
-        log.info('Request to PI WEbServer send')
-    except Exception as e:
-        log.error('socket timed out')
-    else:
-        pi_request.close()
-        log.info('Access successful.')
+    queueEvent(constant.EVENT_BLYNK_CONNECTED, (ping,), True)
     
     
 @blynk.on("disconnected")
 def blynk_disconnected():
     connectBlynkLED.value(0)
     log.critical(getTimeStamp()+"Blynk disconnected")
-    blynk.virtual_write(14, getTimeFromAPI()+"Blynk disconnected")
+    blynk.virtual_write(14, getTimeStamp()+"Blynk disconnected")
+    queueEvent(constant.EVENT_BLYNK_DISCONNECTED, (), True)
+
+#Method to switch one relay. Relays are active low, so Blynk value 1 (on) drives the pin low
+def setRelay(index, state):
+    global relayStates
+    relays[index].value(0 if state else 1)
+    if(state):
+        relayStates = relayStates | 1<<index
+    else:
+        relayStates = relayStates & ~(1<<index)
+
+#Method to save the relay states to flash for the next boot. Only written when they changed
+def saveRelayStates():
+    global savedRelayStates
+    if(not constant.RELAY_RESTORE_AT_BOOT or relayStates==savedRelayStates):
+        return
     try:
-        pi_dis_request=''
-        pi_dis_request=urequests.get(constant.PI_LOCAL_SERVER_URL+'/blynkDisconnect',headers=constant.REQUEST_HEADERS)
-        pi_dis_request.close()
-        log.info('Request to PI WEbServer send')
-    except:
-        log.critical("Unable to communicate with Raspberry PI server. Please check this on priority")
+        with open(constant.RELAY_STATE_FILE, 'wb') as stateFile:
+            stateFile.write(bytes((relayStates,)))
+        savedRelayStates = relayStates
+    except OSError as e:
+        log.error(getTimeStamp()+"Unable to save relay states: {}".format(e))
+
+#Method to read a scene command. Accepts a scene name from constant.SCENES, "mask,states" in one value or mask and states as two values.
+#Bit n of mask selects relay Vn, bit n of states is the value it is switched to
+def parseScene(value):
+    if(value[0] in constant.SCENES):
+        return constant.SCENES[value[0]]
+    if(len(value)>1):
+        return int(value[0]), int(value[1])
+    mask, states = value[0].split(",")
+    return int(mask), int(states)
+
+def applyScene(value):
+    try:
+        mask, states = parseScene(value)
+    except (ValueError, KeyError):
+        log.error(getTimeStamp()+"Invalid scene command: {}".format(value))
+        blynk.virtual_write(14, getTimeStamp()+"Invalid scene command: {}".format(value))
+        return
+    for index in range(len(relays)):
+        bit = 1<<index
+        if(mask & bit):
+            state = 1 if states & bit else 0
+            setRelay(index, state)
+            blynk.virtual_write(index, state)
+    saveRelayStates()
+    log_message = constant.SCENESTATEMSG.format(mask, states)
+    log.info(getTimeStamp()+log_message)
+    blynk.virtual_write(14, getTimeStamp()+log_message)
+    blinkLEDOnEvent()
+    queueEvent(constant.EVENT_RELAY_SCENE, (mask, states))
 
 @blynk.on("V*")
+@timed('vpins')
 def blynk_handle_vpins(pin, value):
-    if(pin=="0"):
-        if(int(value[0])==0):
-            relayD12.value(1)
-            log_message = constant.RELAYSTATEMSG.format(pin,12,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-        else:
-            relayD12.value(0)
-            log_message = constant.RELAYSTATEMSG.format(pin,12,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-    if(pin=="1"):
-        if(int(value[0])==0):
-            relayD13.value(1)
-            log_message = constant.RELAYSTATEMSG.format(pin,13,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-        else:
-            relayD13.value(0)
-            log_message = constant.RELAYSTATEMSG.format(pin,13,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-    if(pin=="2"):
-        if(int(value[0])==0):
-            relayD14.value(1)
-            log_message = constant.RELAYSTATEMSG.format(pin,14,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-        else:
-            relayD14.value(0)
-            log_message = constant.RELAYSTATEMSG.format(pin,14,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-    if(pin=="3"):
-        if(int(value[0])==0):
-            relayD15.value(1)
-            log_message = constant.RELAYSTATEMSG.format(pin,15,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-        else:
-            relayD15.value(0)
-            log_message = constant.RELAYSTATEMSG.format(pin,15,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-    if(pin=="4"):
-        if(int(value[0])==0):
-            relayD21.value(1)
-            log_message = constant.RELAYSTATEMSG.format(pin,21,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-        else:
-            relayD21.value(0)
-            log_message = constant.RELAYSTATEMSG.format(pin,21,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-    if(pin=="5"):
-        if(int(value[0])==0):
-            relayD23.value(1)
-            log_message = constant.RELAYSTATEMSG.format(pin,23,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-        else:
-            relayD23.value(0)
-            log_message = constant.RELAYSTATEMSG.format(pin,23,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-    if(pin=="6"):
-        if(int(value[0])==0):
-            relayD25.value(1)
-            log_message = constant.RELAYSTATEMSG.format(pin,25,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-        else:
-            relayD25.value(0)
-            log_message = constant.RELAYSTATEMSG.format(pin,25,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-    if(pin=="7"):
-        if(int(value[0])==0):
-            relayD26.value(1)
-            log_message = constant.RELAYSTATEMSG.format(pin,26,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
-        else:
-            relayD26.value(0)
-            log_message = constant.RELAYSTATEMSG.format(pin,26,int(value[0]))
-            log.info(getTimeStamp()+log_message)
-            blynk.virtual_write(14, getTimeFromAPI()+log_message)
+    index = int(pin)
+    if(index==constant.SCENE_VPIN):
+        applyScene(value)
+        return
+    if(index>=len(relays)):
+        return
+    state = int(value[0])
+    setRelay(index, state)
+    saveRelayStates()
+    log_message = constant.RELAYSTATEMSG.format(pin,constant.RELAY_GPIO_PINS[index],state)
+    log.info(getTimeStamp()+log_message)
+    blynk.virtual_write(14, getTimeStamp()+log_message)
     blinkLEDOnEvent()
-    try:
-        pin_request=''
-        pin_json = {'pin':pin,'value':value}
-        pin_request=urequests.get(constant.PI_LOCAL_SERVER_URL+'/updateRelayStatus',
-        json=pin_json,
-        headers=constant.REQUEST_HEADERS)
-        pin_request.close()
-        log.info('Request to PI WEbServer send')
-    except:
-        log.critical("Unable to communicate with Raspberry PI server. Please check this on priority")
+    queueEvent(constant.EVENT_RELAY, (index, state))
     
     
+#Rolling window of the last size samples of one sensor value in a fixed array, plus an exponentially weighted moving average
+class SensorWindow:
+
+    def __init__(self, size, alpha):
+        self.values = array('f', [0.0]*size)
+        self.size = size
+        self.alpha = alpha
+        self.head = 0
+        self.count = 0
+        self.ewma = None
+
+    def add(self, value):
+        self.values[self.head] = value
+        self.head = (self.head+1)%self.size
+        if(self.count<self.size):
+            self.count = self.count+1
+        if(self.ewma is None):
+            self.ewma = value
+        else:
+            self.ewma = self.ewma+self.alpha*(value-self.ewma)
+
+    #Method to get (min, max, mean, ewma) over the buffered samples, rounded to one decimal
+    def summary(self):
+        low = high = total = self.values[0]
+        for i in range(1, self.count):
+            value = self.values[i]
+            total = total+value
+            if(value<low):
+                low = value
+            if(value>high):
+                high = value
+        return round(low,1), round(high,1), round(total/self.count,1), round(self.ewma,1)
+
+tempWindow = SensorWindow(constant.DHT_WINDOW_SIZE, constant.DHT_EWMA_ALPHA)
+humWindow = SensorWindow(constant.DHT_WINDOW_SIZE, constant.DHT_EWMA_ALPHA)
+reportedTemp = None
+reportedHum = None
+dhtFailing = False
+
+#Method to send one DHT11 reading to Blynk and the PI server. High temperature alerts are raised by the PI server's alert rules
+def reportDHTReading(temperature, humidity):
+    global reportedTemp, reportedHum
+    reportedTemp = temperature
+    reportedHum = humidity
+    log.info(getTimeStamp()+"Sending DHT11 sensor readings : Temperature={} Humidity={} to Blynk".format(temperature,humidity))
+    blynk.virtual_write(14, getTimeStamp()+"Sending DHT11 sensor readings : Temperature={} Humidity={} to Blynk".format(temperature,humidity))
+    queueEvent(constant.EVENT_DHT_SUCCESS, (temperature, humidity))
+
+def reportDHTFailure(o_err):
+    logErrorDHT = "Unable to get DHT11 sensor data: '{}'".format(o_err)
+    log.error(getTimeStamp()+logErrorDHT)
+    blynk.virtual_write(14, getTimeStamp()+logErrorDHT)
+    queueEvent(constant.EVENT_DHT_FAIL, (str(o_err),))
+
+#Method to take one DHT11 reading and report it straight away. Used when constant.DHT_SAMPLING is off
+@timed('dht')
 def checkDHTSensorData():
     temperature = 0
     humidity = 0
@@ -263,112 +621,198 @@ def checkDHTSensorData():
         dht11.measure()
         temperature = dht11.temperature()
         humidity = dht11.humidity()
-        log.info(getTimeStamp()+"Sending DHT11 sensor readings : Temperature={} Humidity={} to Blynk".format(temperature,humidity))
-        blynk.virtual_write(14, getTimeFromAPI()+"Sending DHT11 sensor readings : Temperature={} Humidity={} to Blynk".format(temperature,humidity))
-        try:
-            pi_temp = ''
-            temp_json = {'temp':temperature,'hum':humidity}
-            pi_temp = urequests.get(constant.PI_LOCAL_SERVER_URL+'/updateDHTSuccess',json=temp_json,headers=constant.REQUEST_HEADERS)
-            log.info('Request to PI WebServer send')
-        except:
-            log.critical('Unable to communicate with Raspberry PI server. Please check this on priority')
-        else:
-            pi_temp.close()    
-        if(temperature>40):
-            request=''
-            sensor_json = {'value1':temperature, 'value2':humidity}
-            request = urequests.post(
-            constant.IFTT_BASE_URL + constant.EMAIL_API_KEY,
-            json=sensor_json,
-            headers=constant.REQUEST_HEADERS)
-            if(request.status_code==200):
-                log.info(getTimeStamp()+"High Room Temperature from DHT11 Detected. Trigerred IFTT Email Event successfully")
-                blynk.virtual_write(14, getTimeFromAPI()+"High Room Temperature from DHT11 Detected. Trigerred IFTT Email Event successfully")
-                try:
-                    pi_email_temp = ''
-                    pi_email_temp = urequests.get(constant.PI_LOCAL_SERVER_URL+'/highTempEmailSuccess',headers=constant.REQUEST_HEADERS)
-                    pi_email_temp.close()
-                    log.info('Request to PI WebServer send')
-                except:
-                    log.critical('Unable to communicate with Raspberry PI server. Please check this on priority')
-            else:
-                log.error(getTimeStamp+"IFTT Email API call failed. Request returned with status code: "+str(request.status_code)+". Please verify URL parameters in constant.py")
-                blynk.virtual_write(14, getTimeFromAPI()+"IFTT Email API call failed. Request returned with status code: "+str(request.status_code)+". Please verify URL parameters in constant.py")
-                try:
-                    pi_email_temp = ''
-                    error_json = {'error':str(request.status_code)}
-                    pi_email_temp = urequests.get(constant.PI_LOCAL_SERVER_URL+'/highTempEmailFail',json=error_json,headers=constant.REQUEST_HEADERS)
-                    log.info('Request to PI WebServer send')
-                except:
-                    log.critical('Unable to communicate with Raspberry PI server. Please check this on priority')
-                else:
-                    pi_email_temp.close()
-            request.close()        
-        
+        reportDHTReading(temperature, humidity)
     except OSError as o_err:
-        logErrorDHT = "Unable to get DHT11 sensor data: '{}'".format(o_err)
-        log.error(getTimeStamp()+logErrorDHT)
-        blynk.virtual_write(14, getTimeFromAPI()+logErrorDHT)
-        try:
-            pi_error_temp = ''
-            temp_json={'error':o_err}
-            pi_error_temp = urequests.get(constant.PI_LOCAL_SERVER_URL+'/updateDHTFail',json=temp_json,headers=constant.REQUEST_HEADERS)
-            log.info('Request to PI WebServer send')
-        except:
-            log.critical('Unable to communicate with Raspberry PI server. Please check this on priority')
-        else:
-            pi_error_temp.close()
+        reportDHTFailure(o_err)
 
     blynk.virtual_write(8, temperature)
     blynk.virtual_write(9, humidity)
-    
+
+#Method to take one DHT11 sample into the rolling windows. The sample is only reported when it is outside the deadband
+#around the last reported reading, and a failure only when the sensor was working before
+@timed('dht')
+def sampleDHTSensor():
+    global dhtFailing
+    try:
+        dht11.measure()
+        temperature = dht11.temperature()
+        humidity = dht11.humidity()
+    except OSError as o_err:
+        if(not dhtFailing):
+            reportDHTFailure(o_err)
+        dhtFailing = True
+        return
+    dhtFailing = False
+    tempWindow.add(temperature)
+    humWindow.add(humidity)
+    if(reportedTemp is None or abs(temperature-reportedTemp)>constant.DHT_TEMP_DEADBAND or abs(humidity-reportedHum)>constant.DHT_HUM_DEADBAND):
+        blynk.virtual_write(8, temperature)
+        blynk.virtual_write(9, humidity)
+        reportDHTReading(temperature, humidity)
+
+#Method to report the rolling window as one summary event. Blynk shows the moving averages
+def sendDHTSummary():
+    if(tempWindow.count==0):
+        return
+    tempMin, tempMax, tempMean, tempEwma = tempWindow.summary()
+    humMin, humMax, humMean, humEwma = humWindow.summary()
+    log_message = "DHT11 summary of {} samples : Temperature min={} max={} mean={} avg={} Humidity min={} max={} mean={} avg={}".format(tempWindow.count,tempMin,tempMax,tempMean,tempEwma,humMin,humMax,humMean,humEwma)
+    log.info(getTimeStamp()+log_message)
+    blynk.virtual_write(14, getTimeStamp()+log_message)
+    blynk.virtual_write(8, tempEwma)
+    blynk.virtual_write(9, humEwma)
+    queueEvent(constant.EVENT_DHT_SUMMARY, (tempMin, tempMax, tempMean, tempEwma, humMin, humMax, humMean, humEwma, tempWindow.count))
+
+#Method to show a weather report on Blynk and buffer it for the PI server
+def publishWeather(openWeatherTemp, openWeatherHum, openWeatherReport, openWeatherPre):
+    blynk.virtual_write(10,openWeatherTemp)
+    blynk.virtual_write(11,openWeatherHum)
+    blynk.virtual_write(12,openWeatherReport)
+    blynk.virtual_write(13,openWeatherPre)
+    log.info(getTimeStamp()+"OpenWeather API call successful. Sending response to Blynk. Temperature={} Humidity={} Report={} Pressure={}".format(str(openWeatherTemp),str(openWeatherHum),openWeatherReport,str(openWeatherPre)))
+    blynk.virtual_write(14, getTimeStamp()+"OpenWeather API call successful. Sending response to Blynk. Temperature={} Humidity={} Report={} Pressure={}".format(str(openWeatherTemp),str(openWeatherHum),openWeatherReport,str(openWeatherPre)))
+    queueEvent(constant.EVENT_WEATHER_SUCCESS, (openWeatherTemp, openWeatherHum, openWeatherReport, openWeatherPre))
+
+def weatherFailed(status_code):
+    log.error(getTimeStamp()+"OpenWeather API call failed. Request returned status code:"+str(status_code)+". Please verify URL parameters in constant.py")
+    blynk.virtual_write(14, getTimeStamp()+"OpenWeather API call failed. Request returned status code:"+str(status_code)+". Please verify URL parameters in constant.py")
+    queueEvent(constant.EVENT_WEATHER_FAIL, (status_code,))
+
+#Method to get the weather from the PI server's /weather gateway. The PI caches OpenWeather for all boards and answers
+#'temperature|humidity|pressure|report', so no JSON is parsed on the board. Falls back to OpenWeather directly if the PI is unreachable
+@timed('weather')
 def checkOpenWeatherAPI():
-    getTimeFromAPI()
-    response=''
-    response=urequests.get(openWeatherAPI)
-    if(response.status_code==200):
-        weatherData=response.json()
-        tempHumPre=weatherData['main']
-        openWeatherTemp=round(tempHumPre['temp'])-273.15
-        openWeatherHum=tempHumPre['humidity']
-        openWeatherPre=tempHumPre['pressure']*0.001
-        openWeatherReport=weatherData['weather'][0]['description']
-        openWeatherReport = openWeatherReport[0].upper() + openWeatherReport[1:]
-        blynk.virtual_write(10,openWeatherTemp)
-        blynk.virtual_write(11,openWeatherHum)
-        blynk.virtual_write(12,openWeatherReport)
-        blynk.virtual_write(13,openWeatherPre)
-        log.info(getTimeStamp()+"OpenWeather API call successful. Sending response to Blynk. Temperature={} Humidity={} Report={} Pressure={}".format(str(openWeatherTemp),str(openWeatherHum),openWeatherReport,str(openWeatherPre)))
-        blynk.virtual_write(14, getTimeFromAPI()+"OpenWeather API call successful. Sending response to Blynk. Temperature={} Humidity={} Report={} Pressure={}".format(str(openWeatherTemp),str(openWeatherHum),openWeatherReport,str(openWeatherPre)))
-        weather_json = {'temp':openWeatherTemp , 'hum':openWeatherHum , 'report':openWeatherReport , 'pressure':openWeatherPre}
-        try:
-            pi_weather = ''
-            pi_weather = urequests.get(constant.PI_LOCAL_SERVER_URL+'/updateWeatherSuccess',json=weather_json,headers=constant.REQUEST_HEADERS)
-            log.info('Request to PI WebServer send')
-        except:
-            log.critical('Unable to communicate with Raspberry PI server. Please check this on priority')
-        else:
-            pi_weather.close()
-        
+    try:
+        status, body = piClient.request('/weather')
+    except OSError:
+        log.error(getTimeStamp()+"PI weather gateway unreachable. Calling OpenWeather directly")
+        checkOpenWeatherDirect()
+        return
+    if(status==200):
+        temp, hum, pressure, report = body.decode().split("|",3)
+        publishWeather(float(temp), int(hum), report, float(pressure))
     else:
-        log.error(getTimeStamp()+"OpenWeather API call failed. Request returned status code:"+str(response.status_code)+". Please verify URL parameters in constant.py")
-        blynk.virtual_write(14, getTimeFromAPI()+"OpenWeather API call failed. Request returned status code:"+str(response.status_code)+". Please verify URL parameters in constant.py")
+        weatherFailed(body.decode() or status)
+
+def checkOpenWeatherDirect():
+    import urequests
+    import JsonExtract
+    try:
+        response=urequests.get(openWeatherAPI,timeout=constant.HTTP_TIMEOUT)
+    except Exception as e:
+        weatherFailed(str(e))
+        return
+    try:
+        if(response.status_code==200):
+            weatherData=JsonExtract.extract(response.raw,('main.temp','main.humidity','main.pressure','weather.0.description'),constant.JSON_CHUNK_SIZE)
+            openWeatherReport=weatherData['weather.0.description']
+            publishWeather(round(weatherData['main.temp']-273.15,1), weatherData['main.humidity'], openWeatherReport[0].upper() + openWeatherReport[1:], weatherData['main.pressure']*0.001)
+        else:
+            weatherFailed(response.status_code)
+    except (OSError, KeyError, ValueError, IndexError) as e:
+        #A dropped connection or truncated response leaves fields missing from weatherData
+        weatherFailed(str(e))
+    finally:
+        response.close()
+
+#Method to read the free bytes and largest free block of the IDF heap, which Wi-Fi and TLS allocate from and the
+#MicroPython heap grows into. Reads the allocator's own counters, nothing is allocated. Firmware without
+#esp32.idf_heap_info reports the MicroPython heap's free bytes for both
+def idfHeap():
+    try:
+        regions = esp32.idf_heap_info(esp32.HEAP_DATA)
+    except AttributeError:
+        free = gc.mem_free()
+        return free, free
+    return sum(region[1] for region in regions), max(region[2] for region in regions)
+
+#Method to send a compact health report to the PI server. Latency stats cover the time since the last heartbeat
+#the PI accepted and are cleared, like the boot timings, only once it has answered 200
+def sendHeartbeat():
+    global heartbeatSeq, bootReported
+    gc.collect()
+    idfFree, largest = idfHeap()
+    try:
+        rssi = wifi.status('rssi')
+    except Exception:
+        rssi = 0
+    heartbeatSeq = heartbeatSeq+1
+    callbacks = {}
+    for name in callbackStats:
+        runs, total, slowest = callbackStats[name]
+        if(runs):
+            callbacks[name] = [runs, total//runs, slowest]
+    heartbeat = {'seq':heartbeatSeq, 'free':gc.mem_free(), 'alloc':gc.mem_alloc(), 'largest':largest, 'idf_free':idfFree, 'rssi':rssi,
+                 'pi_conn':piClient.connectCount, 'pi_fail':piClient.failCount, 'blynk_conn':blynkConnectCount,
+                 'dropped':eventsDropped, 'jobs_dropped':relayJobs.dropped+backgroundJobs.dropped, 'cb':callbacks}
+    if(not bootReported):
+        heartbeat['boot'] = dict(bootPhases)
+    try:
+        status, body = piClient.request('/heartbeat', json.dumps(heartbeat).encode())
+    except OSError:
+        log.error(getTimeStamp()+"Unable to send heartbeat to PI server")
+        return False
+    if(status!=200):
+        log.error(getTimeStamp()+"PI server answered the heartbeat with status code {}".format(status))
+        return False
+    callbackStats.clear()
+    bootReported = True
+    return True
+
+#Method to log how long each boot phase took after reset. Called once Blynk first connects, when relay commands are
+#answered, and queues a heartbeat so the PI gets the timings without waiting for HEARTBEAT_INTERVAL
+def logBootTimings():
+    log.info(getTimeStamp()+"Boot timings (ms since reset): "+", ".join("{} {}".format(name, ms) for name, ms in bootPhases))
+    backgroundJobs.put(sendHeartbeat)
+
+#Task running queued network jobs one at a time, relay jobs first. Each job blocks for at most its socket timeout
+#and the task yields after every job so Blynk is serviced between requests
+async def networkWorker():
+    while True:
+        if(relayJobs.jobs):
+            job = relayJobs.jobs.pop(0)
+        elif(backgroundJobs.jobs):
+            job = backgroundJobs.jobs.pop(0)
+        else:
+            jobReady.clear()
+            await jobReady.wait()
+            continue
         try:
-            pi_weather = ''
-            status_code_json={'code':str(response.status_code)}
-            pi_weather = urequests.get(constant.PI_LOCAL_SERVER_URL+'/updateWeatherFail',json=status_code_json,headers=constant.REQUEST_HEADERS)
-            log.info('Request to PI WebServer send')
-        except:
-            log.critical('Unable to communicate with Raspberry PI server. Please check this on priority')
+            job()
+        except Exception as e:
+            log.error(getTimeStamp()+"Network job failed: {}".format(e))
+        await asyncio.sleep_ms(0)
+
+#Task running func every interval seconds. With jobs given, func is queued there instead of run on the spot
+async def every(interval, func, jobs=None):
+    while True:
+        await asyncio.sleep(interval)
+        if(jobs is None):
+            func()
         else:
-            pi_weather.close()             
-    response.close()
+            jobs.put(func)
 
-#Timers set as below
-DHTSensortimer.set_interval(1800, checkDHTSensorData)
-OpenWeatherAPICall.set_interval(2700, checkOpenWeatherAPI)
+async def main():
+    asyncio.create_task(networkWorker())
+    #The RTC is first set here rather than before Blynk connects. Events sent before then carry their age, so the PI still timestamps them
+    backgroundJobs.put(syncTime)
+    if(constant.DHT_SAMPLING):
+        asyncio.create_task(every(constant.DHT_SAMPLE_INTERVAL, sampleDHTSensor))
+        asyncio.create_task(every(constant.DHT_INTERVAL, sendDHTSummary))
+    else:
+        asyncio.create_task(every(constant.DHT_INTERVAL, checkDHTSensorData))
+    asyncio.create_task(every(constant.WEATHER_INTERVAL, checkOpenWeatherAPI, backgroundJobs))
+    asyncio.create_task(every(constant.TIME_RESYNC_INTERVAL, syncTime, backgroundJobs))
+    asyncio.create_task(every(constant.EVENT_FLUSH_INTERVAL, flushEvents, backgroundJobs))
+    asyncio.create_task(every(constant.HEARTBEAT_INTERVAL, sendHeartbeat, backgroundJobs))
+    #Loop time is the full period between polls, so anything above BLYNK_RUN_INTERVAL_MS is time other tasks held the CPU
+    bootPhase('loop')
+    last = time.ticks_us()
+    while True:
+        blynk.run()
+        await asyncio.sleep_ms(constant.BLYNK_RUN_INTERVAL_MS)
+        now = time.ticks_us()
+        recordLatency('loop', time.ticks_diff(now, last))
+        last = now
 
-while True:
-    blynk.run()
-    DHTSensortimer.run()
-    OpenWeatherAPICall.run()
+asyncio.run(main())
@@ -0,0 +1,289 @@
+import time
+import queue
+import threading
+import collections
+import requests
+
+import config
+import Metrics
+
+#Alert rules evaluated over the readings the server records (the same (series, epoch, value) tuples that go to the
+#TimeSeriesStore). Each rule keeps a small state per series and answers True (condition met), False (cleared) or None
+#(no change). The engine turns those into firing/resolved alerts with hysteresis, cooldown and deduplication, and hands
+#them to a notifier on a background thread so request handlers never wait on an outbound call.
+
+#Readings are named '<device id>/<series>'. A rule applies to its series on every board, or only on 'device' when set,
+#and keeps separate state per board
+class Rule:
+
+    def __init__(self, spec):
+        self.name = spec['name']
+        self.series = spec['series']
+        self.device = spec.get('device')
+        self.cooldown = spec.get('cooldown', config.ALERT_DEFAULT_COOLDOWN)
+        self.notifyResolved = spec.get('notify_resolved', True)
+
+    def matches(self, series):
+        device, _, name = series.rpartition("/")
+        return name==self.series and (self.device is None or device==self.device)
+
+    def evaluate(self, state, epoch, value):
+        return None
+
+    def describe(self, series, value):
+        return "{} on {}".format(self.name, series)
+
+#Fires when the value goes above 'above' (or below 'below') and clears only once it is back past 'clear',
+#so a reading hovering around the threshold does not fire again on every crossing
+class ThresholdRule(Rule):
+
+    def __init__(self, spec):
+        Rule.__init__(self, spec)
+        self.above = spec.get('above')
+        self.below = spec.get('below')
+        if((self.above is None)==(self.below is None)):
+            raise ValueError("Threshold rule '{}' needs exactly one of above or below".format(self.name))
+        self.clear = spec.get('clear', self.above if self.above is not None else self.below)
+
+    def evaluate(self, state, epoch, value):
+        if(self.above is not None):
+            if(value>self.above):
+                return True
+            if(value<self.clear):
+                return False
+        else:
+            if(value<self.below):
+                return True
+            if(value>self.clear):
+                return False
+        return None
+
+    def describe(self, series, value):
+        if(self.above is not None):
+            return "{} is {} (above {})".format(series, value, self.above)
+        return "{} is {} (below {})".format(series, value, self.below)
+
+#Fires when the value has moved by at least 'change' (negative for a fall) within 'window' seconds, and clears when
+#the change over the window is back under 'clear' (half of change by default)
+class RateRule(Rule):
+
+    def __init__(self, spec):
+        Rule.__init__(self, spec)
+        self.change = spec['change']
+        self.window = spec['window']
+        self.clear = spec.get('clear', self.change/2.0)
+
+    def evaluate(self, state, epoch, value):
+        samples = state.get('samples')
+        if(samples is None):
+            samples = state['samples'] = collections.deque()
+        samples.append((epoch, value))
+        while samples and samples[0][0]<epoch-self.window:
+            samples.popleft()
+        delta = value-samples[0][1]
+        state['delta'] = delta
+        if(self.change<0):
+            delta, change, clear = -delta, -self.change, -self.clear
+        else:
+            change, clear = self.change, self.clear
+        if(delta>=change):
+            return True
+        if(delta<clear):
+            return False
+        return None
+
+    def describe(self, series, value):
+        return "{} changed to {} ({:+} within {}s)".format(series, value, self.change, self.window)
+
+#Fires when no reading has arrived for 'timeout' seconds and clears on the next reading. Checked by the engine's timer
+class SilenceRule(Rule):
+
+    def __init__(self, spec):
+        Rule.__init__(self, spec)
+        self.timeout = spec['timeout']
+
+    def evaluate(self, state, epoch, value):
+        return False
+
+    def silent(self, lastSeen, now):
+        return now-lastSeen>=self.timeout
+
+    def describe(self, series, value):
+        return "no {} reading for {}s".format(series, self.timeout)
+
+RULE_TYPES = {'threshold': ThresholdRule, 'rate': RateRule, 'silence': SilenceRule}
+
+def buildRules(specs):
+    rules = []
+    for spec in specs:
+        if(spec.get('type') not in RULE_TYPES):
+            raise ValueError("Unknown alert rule type '{}' in config.py, expected one of {}".format(spec.get('type'), ", ".join(sorted(RULE_TYPES))))
+        rules.append(RULE_TYPES[spec['type']](spec))
+    return rules
+
+#Notifiers take an alert dict {rule, series, state ('firing' or 'resolved'), value, message, time} and deliver it
+
+#Prints alerts, for development without any outbound calls
+class LogNotifier:
+
+    def notify(self, alert):
+        print("ALERT {state}: {message}".format(**alert))
+
+#POSTs the alert as JSON, e.g. to a local stub while testing or to a home automation webhook
+class HTTPNotifier:
+
+    def __init__(self, url, timeout=config.UPSTREAM_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def notify(self, alert):
+        response = requests.post(self.url, json=alert, timeout=self.timeout)
+        if(response.status_code>=300):
+            raise RuntimeError("Alert webhook returned status code {}".format(response.status_code))
+
+#Triggers the IFTTT maker event the ESP32 used to call for high temperatures (value1 = value, value2 = series,
+#value3 = message). Resolved alerts are not sent since the applet only knows one message
+class IFTTTNotifier(HTTPNotifier):
+
+    def __init__(self, key=config.ALERT_IFTTT_KEY, event=config.ALERT_IFTTT_EVENT, timeout=config.UPSTREAM_TIMEOUT):
+        HTTPNotifier.__init__(self, config.ALERT_IFTTT_URL.format(event=event, key=key), timeout)
+
+    def notify(self, alert):
+        if(alert['state']!='firing'):
+            return
+        response = requests.post(self.url, json={'value1': alert['value'], 'value2': alert['series'], 'value3': alert['message']}, timeout=self.timeout)
+        if(response.status_code!=200):
+            raise RuntimeError("IFTTT returned status code {}".format(response.status_code))
+
+#Method to build the notifier selected in config.py
+def createNotifier(name=config.ALERT_NOTIFIER):
+    if(name=='ifttt'):
+        return IFTTTNotifier()
+    if(name=='http'):
+        return HTTPNotifier(config.ALERT_HTTP_URL)
+    if(name=='log'):
+        return LogNotifier()
+    raise ValueError("Unknown ALERT_NOTIFIER '{}' in config.py".format(name))
+
+class AlertEngine:
+
+    def __init__(self, rules, notifier, log=None, checkInterval=config.ALERT_CHECK_INTERVAL,
+                 queueSize=config.ALERT_QUEUE_SIZE, historySize=config.ALERT_HISTORY):
+        self.rules = rules
+        self.notifier = notifier
+        self.log = log
+        self.checkInterval = checkInterval
+        self.history = collections.deque(maxlen=historySize)
+        self._states = {}
+        self._lastSeen = {}
+        self._lock = threading.Lock()
+        self._outbox = queue.Queue(queueSize)
+        self._stop = threading.Event()
+        self._threads = []
+        #Silence is measured from startup for boards named in silence rules that have not reported yet. Other boards
+        #are only watched once they have reported
+        started = time.time()
+        for rule in rules:
+            if(isinstance(rule, SilenceRule) and rule.device is not None):
+                self._lastSeen[rule.device+"/"+rule.series] = started
+
+    #Method to evaluate every rule against new readings, given as (series, epoch, value) tuples
+    def observe(self, readings):
+        with self._lock:
+            for series, epoch, value in readings:
+                if(epoch>self._lastSeen.get(series, 0)):
+                    self._lastSeen[series] = epoch
+                for rule in self.rules:
+                    if(rule.matches(series)):
+                        state = self._state(rule, series)
+                        self._transition(rule, series, state, rule.evaluate(state, epoch, value), epoch, value)
+
+    #Method to fire silence rules for series that stopped reporting. Runs on the engine's timer
+    def checkSilence(self, now=None):
+        if(now is None):
+            now = time.time()
+        with self._lock:
+            for rule in self.rules:
+                if(not isinstance(rule, SilenceRule)):
+                    continue
+                for series, lastSeen in list(self._lastSeen.items()):
+                    if(rule.matches(series) and rule.silent(lastSeen, now)):
+                        self._transition(rule, series, self._state(rule, series), True, now, None)
+
+    def _state(self, rule, series):
+        key = (rule.name, series)
+        state = self._states.get(key)
+        if(state is None):
+            state = self._states[key] = {'active': False, 'notified': False, 'lastFired': None}
+        return state
+
+    #Hysteresis lives in the rules (a rule only returns False once its clear level is passed). Here a rule that is
+    #already active is not sent again (deduplication), and a new firing within the rule's cooldown of the last one
+    #that was sent is recorded but not sent
+    def _transition(self, rule, series, state, result, epoch, value):
+        if(result is True):
+            if(state['active']):
+                Metrics.alertsSuppressed.inc((rule.name, 'duplicate'))
+                return
+            state['active'] = True
+            now = time.monotonic()
+            if(state['lastFired'] is not None and now-state['lastFired']<rule.cooldown):
+                state['notified'] = False
+                Metrics.alertsSuppressed.inc((rule.name, 'cooldown'))
+                self._emit(rule, series, 'suppressed', epoch, value, False)
+                return
+            state['lastFired'] = now
+            state['notified'] = True
+            self._emit(rule, series, 'firing', epoch, value, True)
+        elif(result is False and state['active']):
+            state['active'] = False
+            self._emit(rule, series, 'resolved', epoch, value, state['notified'] and rule.notifyResolved)
+
+    def _emit(self, rule, series, status, epoch, value, send):
+        alert = {'rule': rule.name, 'series': series, 'state': status, 'value': value,
+                 'message': rule.describe(series, value), 'time': epoch}
+        self.history.append(alert)
+        Metrics.alerts.inc((rule.name, status))
+        if(self.log is not None):
+            self.log(epoch, "Alert {} {}: {}".format(rule.name, status, alert['message']))
+        if(send):
+            try:
+                self._outbox.put_nowait(alert)
+            except queue.Full:
+                Metrics.alertsSuppressed.inc((rule.name, 'queue_full'))
+
+    #Active alerts as a list of alert dicts, plus the most recent alerts oldest first
+    def status(self):
+        with self._lock:
+            active = [{'rule': key[0], 'series': key[1], 'notified': state['notified']}
+                      for key, state in self._states.items() if state['active']]
+            return {'active': active, 'recent': list(self.history)}
+
+    def _deliver(self):
+        while True:
+            alert = self._outbox.get()
+            if(alert is None):
+                break
+            try:
+                self.notifier.notify(alert)
+            except Exception as e:
+                Metrics.alertFailures.inc((alert['rule'],))
+                if(self.log is not None):
+                    self.log(time.time(), "Alert {} could not be delivered: {}".format(alert['rule'], e))
+
+    def _checkLoop(self):
+        while not self._stop.wait(self.checkInterval):
+            self.checkSilence()
+
+    def start(self):
+        for target, name in ((self._deliver, "alert-notifier"), (self._checkLoop, "alert-silence")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    #Method to stop the timer and deliver the alerts already queued
+    def stop(self):
+        self._stop.set()
+        self._outbox.put(None)
+        for thread in self._threads:
+            thread.join(config.UPSTREAM_TIMEOUT)
@@ -0,0 +1,321 @@
+#Load generator and benchmark for LocalWebServer.py. Runs fully offline:
+#  - local stand-ins for WorldTimeAPI and OpenWeather answer with a configurable latency
+#  - the server under test is started in a subprocess with its files in a temporary directory, or --target points
+#    at an already running server
+#  - N virtual ESP32 boards each keep one keep-alive connection and send the real endpoint mix
+#Prints throughput, latency percentiles and error rate, overall and per endpoint, and per board the requests
+#completed and the time to the first response. A request taking longer than --timeout (the ESP32's socket timeout)
+#is an error, as it would be on a real board.
+#
+#Example: python3 Benchmark.py --boards 20 --duration 30 --upstream-latency 200 --mode pool --workers 8
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+#Endpoint mix sent by every virtual board as (weight, path, body factory). Bodies match what main.py sends
+def _relay():
+    return {'pin': str(random.randrange(8)), 'value': [str(random.randrange(2))]}
+
+def _scene():
+    return {'mask': random.randrange(1, 256), 'states': random.randrange(256)}
+
+def _dht():
+    return {'temp': random.randint(20, 45), 'hum': random.randint(30, 90)}
+
+def _weather():
+    return {'temp': round(random.uniform(20, 35), 1), 'hum': random.randint(30, 90), 'report': 'Broken clouds', 'pressure': 1.008}
+
+def _ingest():
+    events = [[2, random.randrange(60000), random.randrange(8), random.randrange(2)] for i in range(random.randint(1, 16))]
+    events.append([4, 0, random.randint(20, 45), random.randint(30, 90)])
+    return {'events': events, 'dropped': 0}
+
+ENDPOINT_MIX = (
+    (30, '/updateRelayStatus', _relay),
+    (5, '/updateRelayScene', _scene),
+    (15, '/updateDHTSuccess', _dht),
+    (2, '/updateDHTFail', lambda: {'error': '[Errno 116] ETIMEDOUT'}),
+    (8, '/updateWeatherSuccess', _weather),
+    (2, '/updateWeatherFail', lambda: {'code': '401'}),
+    (3, '/blynk-connection', lambda: {'ping_value': random.randint(20, 200)}),
+    (1, '/blynkDisconnect', None),
+    (1, '/highTempEmailSuccess', None),
+    (1, '/highTempEmailFail', lambda: {'error': '500'}),
+    (15, '/ingest', _ingest),
+    (10, '/weather', None),
+    (7, '/time', None),
+)
+
+#Stand-in for WorldTimeAPI and OpenWeather. Both answer every GET after the configured latency.
+#POSTs are alerts from the server's notifier, which is pointed here so a run never calls IFTTT
+class UpstreamStub(BaseHTTPRequestHandler):
+
+    latency = 0.0
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if(self.path.startswith('/openweather')):
+            data = {'main': {'temp': 301.15, 'humidity': 62, 'pressure': 1008},
+                    'weather': [{'id': 803, 'main': 'Clouds', 'description': 'broken clouds'}]}
+        else:
+            data = {'datetime': time.strftime("%Y-%m-%dT%H:%M:%S.000000+05:30", time.gmtime(time.time()+19800)),
+                    'day_of_week': int(time.strftime("%w"))}
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['content-length'] or 0))
+        self.server.alerts += 1
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def startUpstream(latency):
+    handler = type('UpstreamStubHandler', (UpstreamStub,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    server.alerts = 0
+    threading.Thread(target=server.serve_forever, name="upstream-stub", daemon=True).start()
+    return server
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+#Method to start LocalWebServer in a subprocess with config overrides applied before it is imported
+def startServer(workDir, overrides):
+    bootstrap = ("import json, os, sys\n"
+                 "sys.path.insert(0, {!r})\n"
+                 "import config\n"
+                 "for name, value in json.loads(os.environ['BENCHMARK_CONFIG']).items():\n"
+                 "    setattr(config, name, value)\n"
+                 "import LocalWebServer\n"
+                 "LocalWebServer.main()\n").format(SERVER_DIR)
+    environment = dict(os.environ, BENCHMARK_CONFIG=json.dumps(overrides))
+    output = open(os.path.join(workDir, 'server.out'), 'w')
+    process = subprocess.Popen([sys.executable, '-c', bootstrap], cwd=workDir, env=environment,
+                               stdout=output, stderr=subprocess.STDOUT)
+    deadline = time.monotonic()+15
+    while time.monotonic()<deadline:
+        if(process.poll() is not None):
+            raise RuntimeError("Server exited during startup, see {}".format(output.name))
+        try:
+            socket.create_connection(('127.0.0.1', overrides['HOST_PORT']), 0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server did not start listening within 15s")
+
+def stopServer(process):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+#One simulated ESP32. Sends requests over a single keep-alive connection, reconnecting after errors.
+#Records how many requests it completed and when its first successful response arrived
+class VirtualBoard(threading.Thread):
+
+    def __init__(self, deviceId, host, port, deadline, interval, results, timeout):
+        threading.Thread.__init__(self, daemon=True)
+        self.deviceId = deviceId
+        self.host = host
+        self.port = port
+        self.deadline = deadline
+        self.interval = interval
+        self.results = results
+        self.timeout = timeout
+        self.weights = [entry[0] for entry in ENDPOINT_MIX]
+        self.completed = 0
+        self.errors = 0
+        self.firstResponse = None
+
+    def run(self):
+        connection = None
+        started = time.monotonic()
+        while time.monotonic()<self.deadline:
+            weight, path, bodyFactory = random.choices(ENDPOINT_MIX, self.weights)[0]
+            body = json.dumps(bodyFactory()).encode("utf-8") if bodyFactory else None
+            if(connection is None):
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            sent = time.perf_counter()
+            try:
+                connection.request('GET', path, body=body, headers={'Content-Type': 'application/json', 'X-Device-ID': self.deviceId})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status<400 or (path=='/time' and response.status==503)
+                if(response.getheader('Connection', '').lower()=='close'):
+                    connection.close()
+                    connection = None
+            except (OSError, http.client.HTTPException):
+                ok = False
+                connection.close()
+                connection = None
+            latency = time.perf_counter()-sent
+            ok = ok and latency<=self.timeout
+            self.results.append((path, latency, ok))
+            if(ok):
+                self.completed += 1
+                if(self.firstResponse is None):
+                    self.firstResponse = time.monotonic()-started
+            else:
+                self.errors += 1
+            if(self.interval):
+                time.sleep(random.uniform(0, 2*self.interval))
+        if(connection is not None):
+            connection.close()
+
+def percentile(ordered, fraction):
+    if(not ordered):
+        return 0.0
+    return ordered[min(len(ordered)-1, int(fraction*len(ordered)))]
+
+def summarise(samples, elapsed):
+    latencies = sorted(sample[1] for sample in samples)
+    errors = sum(1 for sample in samples if not sample[2])
+    return {
+        'requests': len(samples),
+        'throughput': len(samples)/elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50)*1000,
+        'p90_ms': percentile(latencies, 0.90)*1000,
+        'p99_ms': percentile(latencies, 0.99)*1000,
+        'max_ms': (latencies[-1] if latencies else 0.0)*1000,
+        'error_rate': errors/len(samples) if samples else 0.0,
+    }
+
+#Method to summarise the boards: completed requests per board and time to the first response. Boards that never got
+#an answer within the timeout are listed as starved
+def summariseBoards(boards):
+    completed = sorted(board.completed for board in boards)
+    firsts = sorted(board.firstResponse for board in boards if board.firstResponse is not None)
+    return {
+        'starved': [board.deviceId for board in boards if board.firstResponse is None],
+        'completed_min': completed[0] if completed else 0,
+        'completed_p50': percentile(completed, 0.50),
+        'completed_max': completed[-1] if completed else 0,
+        'first_response_p50_ms': percentile(firsts, 0.50)*1000,
+        'first_response_max_ms': (firsts[-1] if firsts else 0.0)*1000,
+        'per_board': dict((board.deviceId, {'completed': board.completed, 'errors': board.errors,
+                                            'first_response_ms': None if board.firstResponse is None else board.firstResponse*1000})
+                          for board in boards),
+    }
+
+def printReport(report):
+    header = "{:<24} {:>9} {:>10} {:>9} {:>9} {:>9} {:>9} {:>8}".format('endpoint', 'requests', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'errors')
+    print(header)
+    print("-"*len(header))
+    rows = sorted(report['endpoints'].items())+[('TOTAL', report['total'])]
+    for name, row in rows:
+        print("{:<24} {:>9} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>7.2%}".format(
+            name, row['requests'], row['throughput'], row['p50_ms'], row['p90_ms'], row['p99_ms'], row['max_ms'], row['error_rate']))
+    boards = report['board_summary']
+    print("")
+    print("requests completed per board: min {} / median {} / max {}".format(boards['completed_min'], boards['completed_p50'], boards['completed_max']))
+    print("time to first response: median {:.2f} ms / max {:.2f} ms".format(boards['first_response_p50_ms'], boards['first_response_max_ms']))
+    if(boards['starved']):
+        print("{} boards got no response within {}s: {}".format(len(boards['starved']), report['timeout'], ", ".join(boards['starved'])))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test LocalWebServer with simulated ESP32 boards")
+    parser.add_argument('--boards', type=int, default=10, help="number of simulated ESP32 boards")
+    parser.add_argument('--duration', type=float, default=20, help="seconds to run the load")
+    parser.add_argument('--interval', type=float, default=0, help="mean seconds each board waits between requests (0 = back to back)")
+    parser.add_argument('--upstream-latency', type=float, default=100, help="milliseconds the WorldTimeAPI and OpenWeather stand-ins take to answer")
+    parser.add_argument('--mode', default=None, help="SERVER_MODE for the server under test (pool, threaded, single or prefork)")
+    parser.add_argument('--workers', type=int, default=None, help="SERVER_WORKERS for the server under test (threads per process in prefork mode)")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=JSON', help="extra config.py override, e.g. --set LOG_FSYNC_POLICY='\"batch\"'")
+    parser.add_argument('--timeout', type=float, default=5, help="seconds after which a request counts as failed, like the ESP32's PI_SOCKET_TIMEOUT")
+    parser.add_argument('--target', default=None, help="benchmark an already running server at this URL instead of starting one")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    upstream = None
+    process = None
+    workDir = None
+    if(args.target):
+        target = urlsplit(args.target)
+        host, port = target.hostname, target.port or 80
+    else:
+        upstream = startUpstream(args.upstream_latency/1000.0)
+        upstreamURL = "http://127.0.0.1:{}".format(upstream.server_address[1])
+        host, port = '127.0.0.1', freePort()
+        overrides = {
+            'HOST_NAME': host,
+            'HOST_PORT': port,
+            'WORLDTIMEAPI_URL': upstreamURL+'/worldtime',
+            'OPENWEATHER_BASE_API_URL': upstreamURL+'/openweather',
+            'ALERT_NOTIFIER': 'http',
+            'ALERT_HTTP_URL': upstreamURL+'/alert',
+        }
+        if(args.mode):
+            overrides['SERVER_MODE'] = args.mode
+        if(args.workers):
+            overrides['SERVER_WORKERS'] = args.workers
+        for setting in args.set:
+            name, _, value = setting.partition('=')
+            overrides[name] = json.loads(value)
+        workDir = tempfile.mkdtemp(prefix='pi-benchmark-')
+        process = startServer(workDir, overrides)
+
+    results = []
+    try:
+        started = time.monotonic()
+        deadline = started+args.duration
+        boards = [VirtualBoard("bench-{}".format(i), host, port, deadline, args.interval, results, args.timeout) for i in range(args.boards)]
+        for board in boards:
+            board.start()
+        for board in boards:
+            board.join()
+        elapsed = time.monotonic()-started
+    finally:
+        if(process is not None):
+            stopServer(process)
+        if(upstream is not None):
+            upstream.shutdown()
+
+    byEndpoint = {}
+    for sample in results:
+        byEndpoint.setdefault(sample[0], []).append(sample)
+    report = {
+        'boards': args.boards,
+        'duration': elapsed,
+        'timeout': args.timeout,
+        'total': summarise(results, elapsed),
+        'endpoints': dict((path, summarise(samples, elapsed)) for path, samples in byEndpoint.items()),
+        'board_summary': summariseBoards(boards),
+    }
+    if(args.json):
+        print(json.dumps(report, indent=2))
+    else:
+        print("{} boards for {:.1f}s against {}:{}".format(args.boards, elapsed, host, port))
+        if(workDir):
+            print("Server files in {}, {} alerts delivered to the stub".format(workDir, upstream.alerts))
+        printReport(report)
+    return 1 if report['total']['error_rate']>0 or report['board_summary']['starved'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+import threading
+import collections
+
+import config
+
+#Method to validate a heartbeat body from an ESP32 and normalise it. Raises ValueError, KeyError or TypeError on bad input.
+#Body: {"seq": n, <config.HEARTBEAT_FIELDS>: number, "cb": {name: [count, mean us, max us]}}. Fragmentation is derived
+#here as 1 - largest free block / free heap so the board does not have to compute it. Boards that measure the largest
+#block in the IDF heap also send that heap's free bytes as "idf_free", older ones measure both in the MicroPython heap.
+#The first heartbeat after a restart may also carry "boot": {phase: ms since reset}
+def parseHeartbeat(data):
+    heartbeat = {'seq': int(data['seq'])}
+    for field in config.HEARTBEAT_FIELDS:
+        heartbeat[field] = float(data[field])
+    free = float(data['idf_free']) if 'idf_free' in data else heartbeat['free']
+    heartbeat['frag'] = round(1-heartbeat['largest']/free, 3) if free else 0.0
+    callbacks = {}
+    for name, stats in data.get('cb', {}).items():
+        count, mean, maximum = stats
+        callbacks[str(name)] = [int(count), float(mean), float(maximum)]
+    heartbeat['cb'] = callbacks
+    if('boot' in data):
+        heartbeat['boot'] = dict((str(phase), float(ms)) for phase, ms in data['boot'].items())
+    return heartbeat
+
+#Recent heartbeats per board, kept in bounded deques (config.HEARTBEAT_HISTORY each). Long term history of the
+#numeric fields goes to the TimeSeriesStore, this only answers "what did the board look like lately"
+class HeartbeatHistory:
+
+    def __init__(self, size=config.HEARTBEAT_HISTORY):
+        self.size = size
+        self._boards = {}
+        self._lock = threading.Lock()
+
+    #Method to store one heartbeat. Returns True when the board's sequence number went backwards, i.e. it restarted
+    def add(self, board, epoch, heartbeat):
+        entry = dict(heartbeat, time=epoch)
+        with self._lock:
+            history = self._boards.get(board)
+            if(history is None):
+                history = self._boards[board] = collections.deque(maxlen=self.size)
+            restarted = bool(history) and heartbeat['seq']<history[-1]['seq']
+            history.append(entry)
+        return restarted
+
+    #Heartbeats of one board, oldest first, at most limit of the newest
+    def history(self, board, limit=None):
+        with self._lock:
+            entries = list(self._boards.get(board, ()))
+        if(limit is not None):
+            entries = entries[-limit:] if limit>0 else []
+        return entries
+
+    #Latest heartbeat of every board
+    def latest(self):
+        with self._lock:
+            return dict((board, history[-1]) for board, history in self._boards.items() if history)
@@ -0,0 +1,120 @@
+import time
+import threading
+import requests
+from datetime import datetime
+
+import config
+import Metrics
+
+#Local clock for log timestamps. WorldTimeAPI is asked for the time once, the offset between its answer and
+#time.monotonic() is kept, and every timestamp after that is served from the monotonic clock plus that offset.
+#A background thread resyncs on config.CLOCK_RESYNC_INTERVAL and records how far the clock had drifted.
+class ClockSync:
+
+    def __init__(self, url=config.WORLDTIMEAPI_URL, resyncInterval=config.CLOCK_RESYNC_INTERVAL,
+                 retryInterval=config.CLOCK_RETRY_INTERVAL, staleAfter=config.CLOCK_STALE_AFTER,
+                 timeout=config.CLOCK_SYNC_TIMEOUT):
+        self.url = url
+        self.resyncInterval = resyncInterval
+        self.retryInterval = retryInterval
+        self.staleAfter = staleAfter
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        #Until the first sync succeeds timestamps come from the Pi's own clock and timezone
+        self._offset = time.time() - time.monotonic()
+        self._utcOffset = time.localtime().tm_gmtoff
+        self.lastSync = None
+        self.lastDrift = 0.0
+        self.driftRate = 0.0
+        self.syncCount = 0
+        self.failCount = 0
+        self.lastError = None
+
+    #Method to fetch the time from WorldTimeAPI and update the offset. Returns True on success
+    def sync(self):
+        sent = time.monotonic()
+        try:
+            timeResponse = requests.get(self.url, timeout=self.timeout)
+            received = time.monotonic()
+            if(timeResponse.status_code!=200):
+                raise ValueError("WorldTimeAPI returned status code {}".format(timeResponse.status_code))
+            timeData = timeResponse.json()
+            remote = datetime.fromisoformat(timeData['datetime'])
+        except Exception as e:
+            Metrics.clockSyncLatency.observe(time.monotonic()-sent, ('failure',))
+            with self._lock:
+                self.failCount += 1
+                self.lastError = str(e)
+            return False
+        Metrics.clockSyncLatency.observe(received-sent, ('success',))
+        #The server stamped its answer somewhere inside the round trip, assume half way
+        midpoint = (sent+received)/2
+        offset = remote.timestamp()-midpoint
+        with self._lock:
+            if(self.lastSync is not None):
+                self.lastDrift = offset-self._offset
+                elapsed = midpoint-self.lastSync
+                if(elapsed>0):
+                    self.driftRate = self.lastDrift/elapsed
+            self._offset = offset
+            self._utcOffset = remote.utcoffset().total_seconds()
+            self.lastSync = midpoint
+            self.syncCount += 1
+            self.lastError = None
+        return True
+
+    #Current UTC time in seconds since the epoch
+    def now(self):
+        return time.monotonic()+self._offset
+
+    #Current local time as a struct_time in the WorldTimeAPI timezone
+    def localtime(self, epoch=None):
+        if(epoch is None):
+            epoch = self.now()
+        return time.gmtime(epoch+self._utcOffset)
+
+    #Timestamp prefix used for log lines, same layout getTimeFromAPI used to build from the API response
+    def timestamp(self, epoch=None):
+        return time.strftime("%Y-%m-%d %H:%M:%S ", self.localtime(epoch))
+
+    #Seconds since the last successful sync, None if the clock has never been synced
+    def syncAge(self):
+        if(self.lastSync is None):
+            return None
+        return time.monotonic()-self.lastSync
+
+    def isStale(self):
+        age = self.syncAge()
+        return age is None or age>self.staleAfter
+
+    def status(self):
+        with self._lock:
+            return {
+                'synced': self.lastSync is not None,
+                'stale': self.isStale(),
+                'sync_age': self.syncAge(),
+                'last_drift': self.lastDrift,
+                'drift_rate': self.driftRate,
+                'sync_count': self.syncCount,
+                'fail_count': self.failCount,
+                'last_error': self.lastError,
+            }
+
+    def _run(self):
+        while not self._stop.is_set():
+            synced = self.sync()
+            self._stop.wait(self.resyncInterval if synced else self.retryInterval)
+
+    #Method to start background resyncing. The first sync runs on the background thread so startup never waits on the API
+    def start(self):
+        if(self._thread is None):
+            self._thread = threading.Thread(target=self._run, name="clock-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if(self._thread is not None):
+            self._thread.join(self.timeout+1)
+            self._thread = None
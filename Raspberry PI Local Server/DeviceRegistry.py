@@ -0,0 +1,104 @@
+import os
+import re
+import threading
+
+import config
+import LogQuery
+from LogWriter import LogWriter
+
+#Device IDs end up in file names, series names and metric labels, so only a short safe alphabet is accepted
+DEVICE_ID = re.compile(r"[A-Za-z0-9_-]{1,32}$")
+
+#Raised when a new board shows up while config.DEVICE_MAX boards are already registered
+class RegistryFull(Exception):
+    pass
+
+#Method to get the device ID of a request from its X-Device-ID value. Boards running firmware without device IDs are
+#named after their address (ip-192-168-1-112). Raises ValueError for IDs outside the safe alphabet
+def deviceId(value, address):
+    if(not value):
+        return "ip-"+re.sub(r"[^0-9A-Za-z]", "-", address)
+    if(not DEVICE_ID.match(value)):
+        raise ValueError("Invalid device ID '{}', expected 1-32 letters, digits, '-' or '_'".format(value[:40]))
+    return value
+
+#One board: its own log file (with a LogQuery over it), relay states, latest value of every series it reports and
+#when it was last heard from
+class Device:
+
+    def __init__(self, deviceId, address, now, logDir, logFactory=LogWriter):
+        self.id = deviceId
+        self.address = address
+        self.firstSeen = now
+        self.lastSeen = now
+        self.requests = 0
+        self.relays = [None]*len(config.RELAY_GPIO_PINS)
+        self.readings = {}
+        self.logPath = os.path.join(logDir, deviceId+".log")
+        self.log = logFactory(self.logPath)
+        self.logQuery = LogQuery.LogQuery(self.logPath)
+
+    #Method to keep the relay states in step with relay and scene events, fields as sent by the board
+    def applyEvent(self, code, fields):
+        if(code==config.EVENT_RELAY):
+            value = fields[1]
+            if(isinstance(value, list)):
+                value = value[0]
+            self.relays[int(fields[0])] = int(value)
+        elif(code==config.EVENT_RELAY_SCENE):
+            mask = int(fields[0])
+            states = int(fields[1])
+            for index in range(len(self.relays)):
+                if(mask & 1<<index):
+                    self.relays[index] = 1 if states & 1<<index else 0
+
+    #Method to keep the newest value per series from (series, epoch, value) readings
+    def updateReadings(self, readings):
+        for name, epoch, value in readings:
+            current = self.readings.get(name)
+            if(current is None or epoch>=current[0]):
+                self.readings[name] = (epoch, value)
+
+    def status(self):
+        return {'id': self.id, 'address': self.address, 'first_seen': self.firstSeen, 'last_seen': self.lastSeen,
+                'requests': self.requests, 'relays': self.relays,
+                'readings': dict((name, {'time': epoch, 'value': value}) for name, (epoch, value) in self.readings.items())}
+
+#In-memory registry of the boards talking to this server, a dict keyed by device ID. Lookups of known boards take no
+#lock, only registering a new board does. At most config.DEVICE_MAX boards are kept since each holds an open log.
+#logFactory builds the board logs, a LogWriter unless the writes go elsewhere (Prefork.QueuedLog)
+class DeviceRegistry:
+
+    def __init__(self, logDir=config.DEVICE_LOG_DIR, maxDevices=config.DEVICE_MAX, logFactory=LogWriter):
+        self.logDir = logDir
+        self.maxDevices = maxDevices
+        self.logFactory = logFactory
+        self._devices = {}
+        self._lock = threading.Lock()
+        os.makedirs(logDir, exist_ok=True)
+
+    #Method to get the board with this ID, registering it on first contact, and mark it as seen now
+    def touch(self, deviceId, address, now):
+        device = self._devices.get(deviceId)
+        if(device is None):
+            with self._lock:
+                device = self._devices.get(deviceId)
+                if(device is None):
+                    if(len(self._devices)>=self.maxDevices):
+                        raise RegistryFull("Device limit of {} reached".format(self.maxDevices))
+                    device = self._devices[deviceId] = Device(deviceId, address, now, self.logDir, self.logFactory)
+        device.lastSeen = now
+        device.address = address
+        device.requests += 1
+        return device
+
+    def get(self, deviceId):
+        return self._devices.get(deviceId)
+
+    def devices(self):
+        return sorted(self._devices.values(), key=lambda device: device.id)
+
+    def close(self):
+        with self._lock:
+            for device in self._devices.values():
+                device.log.close()
@@ -0,0 +1,174 @@
+import json
+import time
+import socket
+import selectors
+import threading
+import collections
+
+import config
+import Metrics
+
+#Raised when a dashboard subscribes while config.SSE_MAX_CLIENTS are already connected
+class HubFull(Exception):
+    pass
+
+#One connected dashboard. Event types and device are filters, None means everything
+class Subscriber:
+
+    def __init__(self, sock, types, device):
+        self.sock = sock
+        self.types = types
+        self.device = device
+        self.pending = collections.deque()
+        self.pendingBytes = 0
+
+    def wants(self, kind, device):
+        return (self.types is None or kind in self.types) and (self.device is None or device is None or device==self.device)
+
+#Fan-out of live events to dashboards over Server-Sent Events. Subscribed sockets are taken over from the request
+#handler (so they do not hold an HTTP worker thread) and written by a single non-blocking writer thread.
+#publish() only appends the encoded event to each subscriber's queue, it never writes to a socket, so the ingest path is
+#never blocked by a dashboard. A subscriber whose queue grows past config.SSE_CLIENT_BUFFER bytes is dropped.
+class EventHub:
+
+    def __init__(self, maxClients=config.SSE_MAX_CLIENTS, bufferBytes=config.SSE_CLIENT_BUFFER,
+                 keepalive=config.SSE_KEEPALIVE_INTERVAL):
+        self.maxClients = maxClients
+        self.bufferBytes = bufferBytes
+        self.keepalive = keepalive
+        #Replaced as a whole on subscribe and drop, so publish can iterate it without holding the lock
+        self._subscribers = ()
+        self._lock = threading.Lock()
+        #Created by start(), so each 'prefork' worker process has a pair of its own rather than one shared across the fork
+        self._wakeRead = self._wakeWrite = None
+        self._running = False
+        self._thread = None
+
+    def clientCount(self):
+        return len(self._subscribers)
+
+    #Method to take over a connected socket whose response headers have been sent. first is written before any event
+    def subscribe(self, sock, types=None, device=None, first=b""):
+        subscriber = Subscriber(sock, types, device)
+        sock.setblocking(False)
+        with self._lock:
+            if(len(self._subscribers)>=self.maxClients):
+                raise HubFull("{} dashboards already connected".format(self.maxClients))
+            if(first):
+                subscriber.pending.append(first)
+                subscriber.pendingBytes = len(first)
+            self._subscribers = self._subscribers+(subscriber,)
+        Metrics.sseClients.set(len(self._subscribers))
+        self._wake()
+        return subscriber
+
+    #Method to send an event to every subscriber that wants it. device is the board the event is about, if any
+    def publish(self, kind, data, device=None):
+        subscribers = self._subscribers
+        if(not subscribers):
+            return
+        payload = "event: {}\ndata: {}\n\n".format(kind, json.dumps(data)).encode("utf-8")
+        slow = []
+        with self._lock:
+            for subscriber in subscribers:
+                if(not subscriber.wants(kind, device)):
+                    continue
+                if(subscriber.pendingBytes+len(payload)>self.bufferBytes):
+                    slow.append(subscriber)
+                    continue
+                subscriber.pending.append(payload)
+                subscriber.pendingBytes += len(payload)
+        Metrics.sseEvents.inc((kind,))
+        for subscriber in slow:
+            self._drop(subscriber, 'slow')
+        self._wake()
+
+    def _wake(self):
+        if(self._wakeWrite is None):
+            return
+        try:
+            self._wakeWrite.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def _drop(self, subscriber, reason):
+        with self._lock:
+            if(subscriber not in self._subscribers):
+                return
+            self._subscribers = tuple(other for other in self._subscribers if other is not subscriber)
+            subscriber.pending.clear()
+            subscriber.pendingBytes = 0
+        try:
+            subscriber.sock.close()
+        except OSError:
+            pass
+        Metrics.sseClients.set(len(self._subscribers))
+        Metrics.sseDropped.inc((reason,))
+
+    #Method to write as much queued data to one subscriber as its socket takes without blocking
+    def _flush(self, subscriber):
+        while True:
+            with self._lock:
+                if(not subscriber.pending):
+                    return
+                data = subscriber.pending[0]
+            try:
+                sent = subscriber.sock.send(data)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self._drop(subscriber, 'closed')
+                return
+            with self._lock:
+                if(not subscriber.pending or subscriber.pending[0] is not data):
+                    return
+                subscriber.pendingBytes -= sent
+                if(sent==len(data)):
+                    subscriber.pending.popleft()
+                else:
+                    subscriber.pending[0] = data[sent:]
+                    return
+
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeRead, selectors.EVENT_READ)
+        nextKeepalive = time.monotonic()+self.keepalive
+        while self._running:
+            #Sockets that could not take everything are retried shortly, otherwise sleep until the next publish
+            backlog = any(subscriber.pending for subscriber in self._subscribers)
+            selector.select(0.05 if backlog else max(0, nextKeepalive-time.monotonic()))
+            try:
+                while self._wakeRead.recv(4096):
+                    pass
+            except (BlockingIOError, InterruptedError):
+                pass
+            if(time.monotonic()>=nextKeepalive):
+                #A comment line keeps proxies from timing out the stream and finds dashboards that went away
+                for subscriber in self._subscribers:
+                    with self._lock:
+                        subscriber.pending.append(b": keepalive\n\n")
+                        subscriber.pendingBytes += 13
+                nextKeepalive = time.monotonic()+self.keepalive
+            for subscriber in self._subscribers:
+                self._flush(subscriber)
+        selector.close()
+
+    def start(self):
+        self._wakeRead, self._wakeWrite = socket.socketpair()
+        self._wakeRead.setblocking(False)
+        self._wakeWrite.setblocking(False)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="sse-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake()
+        if(self._thread is not None):
+            self._thread.join(1)
+        for subscriber in self._subscribers:
+            self._drop(subscriber, 'shutdown')
+        if(self._wakeWrite is not None):
+            self._wakeRead.close()
+            self._wakeWrite.close()
+            self._wakeRead = self._wakeWrite = None
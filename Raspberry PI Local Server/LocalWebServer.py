@@ -1,157 +1,1014 @@
-import RPi.GPIO as GPIO
-import os
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    #Not running on a Pi, e.g. under Benchmark.py on a development machine
+    GPIO = None
 import json
 import config
-import requests
-from http.server import BaseHTTPRequestHandler, HTTPServer
-
- #Method to get timestamp from WorldTime API
-def getTimeFromAPI():
-    timeResponse=requests.get(config.WORLDTIMEAPI_URL)
-    if(timeResponse.status_code==200):
-        timeData=timeResponse.json()
-        dateTime=timeData['datetime']
-        dateTime=dateTime.replace("T"," ")
-        dateTime=dateTime.split(".",1)[0]+" "
-        return dateTime
-    else:
-        return "**Time API Error**: "
+import queue
+import signal
+import socket
+import selectors
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qsl
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+
+from ClockSync import ClockSync
+from LogWriter import LogWriter
+from TimeSeriesStore import TimeSeriesStore
+import LogQuery
+import WeatherGateway
+import Metrics
+import BoardHealth
+import AlertEngine
+import DeviceRegistry
+import EventHub
+import Prefork
+
+clock = ClockSync()
+if(config.SERVER_MODE=='prefork'):
+    #Worker processes only queue log lines and readings, the writer process owns the files and the database
+    esp32Log = Prefork.QueuedLog(config.ESP32LOG_FILE_NAME)
+    readingStore = Prefork.QueuedStore()
+    devices = DeviceRegistry.DeviceRegistry(logFactory=Prefork.QueuedLog)
+else:
+    esp32Log = LogWriter(config.ESP32LOG_FILE_NAME)
+    readingStore = TimeSeriesStore()
+    devices = DeviceRegistry.DeviceRegistry()
+logQuery = LogQuery.LogQuery(config.ESP32LOG_FILE_NAME)
+heartbeats = BoardHealth.HeartbeatHistory()
+hub = EventHub.EventHub()
+
+def logAlert(epoch, message):
+    esp32Log.write(getTimeFromAPI(epoch)+message)
+    hub.publish('alert', {'time': epoch, 'message': message})
+
+if(config.SERVER_MODE=='prefork'):
+    #The writer process runs the rules over the readings it stores
+    alertEngine = Prefork.AlertStatus()
+else:
+    alertEngine = AlertEngine.AlertEngine(AlertEngine.buildRules(config.ALERT_RULES), AlertEngine.createNotifier(), logAlert)
+
+#Method to get the timestamp prefix for log lines, for now or for the given epoch. Served from the local clock, WorldTimeAPI is only contacted by the background resync
+def getTimeFromAPI(epoch=None):
+    started = time.perf_counter()
+    timestamp = clock.timestamp(epoch)
+    Metrics.timestampLatency.observe(time.perf_counter()-started)
+    return timestamp
+
+#Method to describe the clock sync state for the status page
+def clockStatusText():
+    status = clock.status()
+    if(not status['synced']):
+        return "Not synced with WorldTimeAPI, using system clock ({} failed attempts)".format(status['fail_count'])
+    text = "Synced {:.0f}s ago, last drift {:+.3f}s".format(status['sync_age'], status['last_drift'])
+    if(status['stale']):
+        text = text+" (STALE)"
+    return text
+
+#Raised by request handlers to answer with an error status instead of the normal response
+class RequestError(Exception):
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+        self.message = message
+
+#Route registry. Maps a request path to the function handling it, looked up once per request.
+#Handlers take the MyServer instance and return (status, content type, body bytes), or None for an empty 200.
+#The body may also be an iterable of bytes chunks, which is streamed with chunked transfer encoding.
+#Routes registered with board=True are the ones the ESP32 calls. Their requests are matched to a board in the device
+#registry (request.device) before the handler runs
+ROUTES = {}
+BOARD_ROUTES = set()
+
+def route(path, board=False):
+    def register(handler):
+        ROUTES[path] = handler
+        if(board):
+            BOARD_ROUTES.add(path)
+        return handler
+    return register
+
+EMPTY_RESPONSE = (200, 'text/html', b'')
+
+#Returned by a handler that has sent its own response headers and handed the connection over (see MyServer.detach)
+DETACHED = object()
+
+#Connections handed over to the EventHub. The server must leave them open when their request finishes
+detachedConnections = set()
+
+#Static parts of the status page are rendered once, only the clock line changes per request
+STATUS_PAGE_HEAD = '''
+               <html>
+               <body
+               style="width:960px; margin: 20px auto;">
+               <h1><center>Raspberry Pi Local Web Server Version {}<center></h1>
+               <h1><center>(Developed by Jacob)<center></h1>
+               <p style="color:green">PI Server Status: Online</p>
+               <p>Raspberry PI Local Web Server IP Address: {}</p>
+               <p>Raspberry PI Local Web Server IP Port   : {}</p>
+'''.format(config.WEB_SERVER_VERSION,config.HOST_NAME,config.HOST_PORT).encode("utf-8")
+STATUS_PAGE_TAIL = b'''
+               <h3>Live events</h3>
+               <pre id="events" style="height:300px; overflow:auto; background:#f4f4f4"></pre>
+               <script>
+               var events = document.getElementById("events");
+               var source = new EventSource("/events");
+               ["relay", "reading", "connection", "sensor_error", "alert"].forEach(function(type) {
+                   source.addEventListener(type, function(e) { events.textContent = type+" "+e.data+"\n"+events.textContent.slice(0, 20000); });
+               });
+               </script>
+               </body>
+               </html>
+            '''
 
 class MyServer(BaseHTTPRequestHandler):
 
+    #HTTP/1.1 keeps the ESP32's connection open between reports. Every response carries a Content-Length so the
+    #client knows where it ends, and idle connections are closed after config.KEEPALIVE_TIMEOUT seconds.
+    #The socket timeout only covers a request in progress, so a stalled client cannot hold a worker for long
+    protocol_version = 'HTTP/1.1'
+    timeout = config.REQUEST_TIMEOUT
+    #Headers and body go out in separate writes, Nagle would hold the body back until the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+    #Set by handle() when the connection is waiting for its next request and the server should watch it (see park)
+    idle = False
+
+    #What happens between requests on a keep-alive connection depends on the server's idleConnections:
+    #'hold' keeps reading on this thread, 'park' returns so the pool server can watch the socket without a worker,
+    #'close' answers with Connection: close so a single threaded server is never held by an idle board
+    def handle(self):
+        self.idle = False
+        idleConnections = getattr(self.server, 'idleConnections', 'hold')
+        if(idleConnections=='close'):
+            BaseHTTPRequestHandler.handle(self)
+            return
+        if(idleConnections=='hold'):
+            self.close_connection = True
+            self.handle_one_request()
+            while not self.close_connection and self._awaitRequest():
+                self.handle_one_request()
+            return
+        self.close_connection = False
+        while not self.close_connection:
+            if(not self._requestWaiting()):
+                self.idle = not self.close_connection
+                return
+            self.handle_one_request()
+
+    #Method to wait up to config.KEEPALIVE_TIMEOUT seconds for the client's next request. False once the client closed
+    #the connection or stayed idle too long
+    def _awaitRequest(self):
+        self.connection.settimeout(config.KEEPALIVE_TIMEOUT)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    #Method to check without blocking whether the client has sent (part of) its next request. A client that closed
+    #the connection sets close_connection instead
+    def _requestWaiting(self):
+        self.connection.setblocking(False)
+        try:
+            if(self.rfile.peek(1)):
+                return True
+            if(not self.connection.recv(1, socket.MSG_PEEK)):
+                self.close_connection = True
+            return False
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:
+            self.close_connection = True
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    #Method to check without blocking whether the client has closed the connection
+    def _clientClosed(self):
+        self.connection.setblocking(False)
+        try:
+            return not self.connection.recv(1, socket.MSG_PEEK)
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:
+            return True
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def finish(self):
+        if(self.idle):
+            return
+        BaseHTTPRequestHandler.finish(self)
+
+    #Method to go on with a parked connection once the client sent its next request. Returns the handler
+    def resume(self):
+        try:
+            self.handle()
+        finally:
+            self.finish()
+        return self
+
+    #Method to close a parked connection's streams, the server then closes the socket
+    def closeIdle(self):
+        self.idle = False
+        self.finish()
+
     def do_HEAD(self):
         self.send_response(200)
         self.send_header('Content-type', 'text/html')
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
     def _redirect(self, path):
         self.send_response(303)
         self.send_header('Content-type', 'text/html')
         self.send_header('Location', path)
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
-    def do_GET(self):
-        if(self.path=='/blynk-connection'):
-            content_length = int(self.headers['content-length'])
-            body = self.rfile.read(content_length)
-            result = json.loads(body)
-            ping = result['ping_value']
-            self.do_HEAD()
-            f=open(config.ESP32LOG_FILE_NAME,"a")
-            f.write(getTimeFromAPI()+"ESP32 connected to Blynk with ping:"+str(ping)+"\n")
-            f.close()
-        if(self.path=='/highTempEmailSuccess'):
-            self.do_HEAD()
-            f=open(config.ESP32LOG_FILE_NAME,"a")
-            f.write(getTimeFromAPI()+"ESP32 has triggered a successful IFTT email event due to high temperature detection."+"\n")
-            f.close()
-        if(self.path=='/blynkDisconnect'):
-            self.do_HEAD()
-            f=open(config.ESP32LOG_FILE_NAME,"a")
-            f.write(getTimeFromAPI()+"Critical: ESP32 has disconnected from blynk. Please check on priority"+"\n")
-            f.close()
-        if(self.path=='/highTempEmailFail'):
-            content_length = int(self.headers['content-length'])
-            body = self.rfile.read(content_length)
-            result = json.loads(body)
-            error = result['error']
-            self.do_HEAD()
-            f=open(config.ESP32LOG_FILE_NAME,"a")
-            f.write(getTimeFromAPI()+"ESP32 has attempted to trigger an IFTT mail event but event has failed with status code: {} Due to this email has not been send".format(error)+"\n")
-            f.close()
-        if(self.path=='/updateWeatherFail'):
-            content_length = int(self.headers['content-length'])
-            body = self.rfile.read(content_length)
-            result = json.loads(body)
-            status_code = result['code']
-            self.do_HEAD()
-            f=open(config.ESP32LOG_FILE_NAME,"a")
-            f.write(getTimeFromAPI()+"ESP32 received error response code {} when trying to connect with OpenWeatherAPI. Blynk may not have the latest weather data due to this.".format(status_code)+"\n")
-            f.close()
-        if(self.path=='/updateDHTSuccess'):
-            content_length = int(self.headers['content-length'])
-            body = self.rfile.read(content_length)
-            result = json.loads(body)
-            temp = result['temp']
-            hum = result['hum']
-            self.do_HEAD()
-            f=open(config.ESP32LOG_FILE_NAME,"a")
-            f.write(getTimeFromAPI()+"ESP32 received sensor readings from DHT11 and updated the sensor data to Blynk. (Temperature: {} Humidity: {})".format(temp,hum)+"\n")
-            f.close()
-        if(self.path=='/updateDHTFail'):
-            content_length = int(self.headers['content-length'])
-            body = self.rfile.read(content_length)
-            result = json.loads(body)
-            error = result['error']
-            self.do_HEAD()
-            f=open(config.ESP32LOG_FILE_NAME,"a")
-            f.write(getTimeFromAPI()+"ESP32 could not read DHT11 sensor. Sensor returned error: {} Please check connection or if the sensor is faulty".format(error)+"\n")
-            f.close()
-        if (self.path=="/updateWeatherSuccess"):
-            content_length = int(self.headers['content-length'])
-            body = self.rfile.read(content_length)
-            result = json.loads(body)
-            temp = result['temp']
-            hum = result['hum']
-            report = result['report']
-            pressure = result['pressure']
-            f=open(config.ESP32LOG_FILE_NAME,"a")
-            f.write(getTimeFromAPI()+"ESP32 received weather data from OpenWeather API and send data to Blynk cloud (Temperature = {} Humidity = {} Report = {} Pressure = {}".format(temp,hum,report,pressure)+"\n")
-            f.close()
-            
-        if (self.path=='/updateRelayStatus'):
-            content_length = int(self.headers['content-length'])
-            body = self.rfile.read(content_length)
+    #Query string parameters as a dict, last value wins for repeated names
+    @property
+    def query(self):
+        return dict(parse_qsl(urlsplit(self.path).query))
+
+    #Method to find the calling board in the registry from its X-Device-ID header (or ?device=), registering new boards
+    def _identify(self):
+        try:
+            deviceId = DeviceRegistry.deviceId(self.headers['X-Device-ID'] or self.query.get('device'), self.client_address[0])
+        except ValueError as e:
+            raise RequestError(400, str(e))
+        try:
+            self.device = devices.touch(deviceId, self.client_address[0], clock.now())
+        except DeviceRegistry.RegistryFull as e:
+            raise RequestError(503, str(e))
+        Metrics.boardLastSeen.set(self.device.lastSeen, (deviceId,))
+
+    #Method to hand the connection over after the handler has sent the response headers itself. The server stops
+    #reading requests from it and does not close it when this request finishes
+    def detach(self):
+        detachedConnections.add(self.connection)
+        self.close_connection = True
+
+    #Method to read the request body and decode it as a JSON object, validating Content-Length first
+    def readJSON(self):
+        content_length = self.headers['content-length']
+        if(content_length is None):
+            raise RequestError(411, "Content-Length header is required")
+        try:
+            content_length = int(content_length)
+        except ValueError:
+            raise RequestError(400, "Invalid Content-Length header")
+        if(content_length<0 or content_length>config.MAX_BODY_BYTES):
+            raise RequestError(413, "Request body must be at most {} bytes".format(config.MAX_BODY_BYTES))
+        body = self.rfile.read(content_length)
+        self.bodyRead = True
+        if(len(body)!=content_length):
+            raise RequestError(400, "Request body shorter than Content-Length")
+        try:
             result = json.loads(body)
-            pin = result['pin']
-            value = result['value']
-            f=open(config.ESP32LOG_FILE_NAME,"a")
-            if (pin == '0'):
-                f.write(getTimeFromAPI()+config.RELAYSTATEMSG.format(pin,12,value)+"\n")
-            if (pin == '1'):
-                f.write(getTimeFromAPI()+config.RELAYSTATEMSG.format(pin,13,value)+"\n")
-            if (pin == '2'):
-                f.write(getTimeFromAPI()+config.RELAYSTATEMSG.format(pin,14,value)+"\n")
-            if (pin == '3'):
-                f.write(getTimeFromAPI()+config.RELAYSTATEMSG.format(pin,15,value)+"\n")
-            if (pin == '4'):
-                f.write(getTimeFromAPI()+config.RELAYSTATEMSG.format(pin,21,value)+"\n")
-            if (pin == '5'):
-                f.write(getTimeFromAPI()+config.RELAYSTATEMSG.format(pin,23,value)+"\n")
-            if (pin == '6'):
-                f.write(getTimeFromAPI()+config.RELAYSTATEMSG.format(pin,25,value)+"\n")
-            if (pin == '7'):
-                f.write(getTimeFromAPI()+config.RELAYSTATEMSG.format(pin,26,value)+"\n")
-            f.close()
-            self.do_HEAD()
-            
+        except ValueError:
+            Metrics.jsonFailures.inc((self.routeName,))
+            raise RequestError(400, "Request body is not valid JSON")
+        if(not isinstance(result, dict)):
+            Metrics.jsonFailures.inc((self.routeName,))
+            raise RequestError(400, "Request body must be a JSON object")
+        return result
+
+    #Method to handle a request and record its count and latency. Unregistered paths are counted as 'status_page'
+    #so random URLs cannot grow the number of label combinations
+    def _dispatch(self):
+        started = time.perf_counter()
+        path = self.path.split('?',1)[0]
+        self.routeName = path if path in ROUTES else 'status_page'
+        status = self._respond(ROUTES.get(path, statusPage), path in BOARD_ROUTES)
+        Metrics.requestCount.inc((self.routeName, status))
+        Metrics.requestLatency.observe(time.perf_counter()-started, (self.routeName,))
+
+    #Method to run the handler and send its response. Returns the status code sent
+    def _respond(self, handler, board=False):
+        self.bodyRead = False
+        self.device = None
+        if(getattr(self.server, 'idleConnections', 'hold')=='close'):
+            self.close_connection = True
+        try:
+            if(board):
+                self._identify()
+            response = handler(self)
+        except RequestError as e:
+            response = (e.status, 'text/plain', e.message.encode("utf-8"))
+        except KeyError as e:
+            response = (400, 'text/plain', "Missing field {} in request body".format(e).encode("utf-8"))
+        except (ValueError, TypeError) as e:
+            response = (400, 'text/plain', "Invalid field in request body: {}".format(e).encode("utf-8"))
+        if(response is DETACHED):
+            return 200
+        if(response is None):
+            response = EMPTY_RESPONSE
+        status, content_type, body = response
+        if(not isinstance(body, bytes)):
+            self._stream(status, content_type, body)
+            return status
+        #A body the handler did not read would be parsed as the next request, so drop the connection instead
+        if(not self.bodyRead and self.headers['content-length'] not in (None, '0')):
+            self.close_connection = True
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if(self.close_connection):
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    #Method to send a response body produced chunk by chunk, so large results never sit in memory at once.
+    #HTTP/1.0 clients get the raw chunks and the connection is closed at the end instead
+    def _stream(self, status, content_type, chunks):
+        chunked = self.request_version!='HTTP/1.0'
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Cache-Control', 'no-cache')
+        if(chunked):
+            self.send_header('Transfer-Encoding', 'chunked')
+            if(self.close_connection):
+                self.send_header('Connection', 'close')
         else:
-            html = '''
-               <html>
-               <body
-               style="width:960px; margin: 20px auto;">
-               <h1><center>Raspberry Pi Local Web Server Version {}<center></h1>
-               <h1><center>(Developed by Jacob)<center></h1>
-               <p style="color:green">PI Server Status: Online</p>
-               <p>Raspberry PI Local Web Server IP Address: {}</p>
-               <p>Raspberry PI Local Web Server IP Port   : {}</p>
-               </body>
-               </html>
-            '''
-            self.do_HEAD()
-            self.wfile.write(html.format(config.WEB_SERVER_VERSION,config.HOST_NAME,config.HOST_PORT).encode("utf-8"))
+            self.close_connection = True
+            self.send_header('Connection', 'close')
+        try:
+            self.end_headers()
+            for chunk in chunks:
+                if(not chunk):
+                    #Generators yield empty chunks while they wait, a client that left ends the stream
+                    if(self._clientClosed()):
+                        self.close_connection = True
+                        return
+                    continue
+                if(chunked):
+                    self.wfile.write(b"%x\r\n" % len(chunk)+chunk+b"\r\n")
+                else:
+                    self.wfile.write(chunk)
+            if(chunked):
+                self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError, socket.timeout):
+            self.close_connection = True
+        finally:
+            if(hasattr(chunks, 'close')):
+                chunks.close()
+
+    def do_GET(self):
+        self._dispatch()
 
     def do_POST(self):
-        print('here')
+        self._dispatch()
 
 
-# # # # # Main # # # # #
+def jsonResponse(data, status=200):
+    return (status, 'application/json', json.dumps(data).encode("utf-8"))
 
-if __name__ == '__main__':
-    http_server = HTTPServer((config.HOST_NAME, config.HOST_PORT), MyServer)
-    print("Server Starts - %s:%s" % (config.HOST_NAME, config.HOST_PORT))
+#Method to read a time from a query parameter. Accepts epoch seconds or a local 'YYYY-MM-DD[ HH:MM:SS]' string
+def parseTime(value, default):
+    if(value is None or value==''):
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise RequestError(400, "Invalid time '{}', expected epoch seconds or YYYY-MM-DD HH:MM:SS".format(value))
+
+#Method to read a log time from a query parameter as a 'YYYY-MM-DD HH:MM:SS' key. Accepts epoch seconds or a local time string
+def logTimeKey(value):
+    if(value is None or value==''):
+        return None
+    try:
+        return getTimeFromAPI(float(value)).strip().encode()
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S").encode()
+    except ValueError:
+        raise RequestError(400, "Invalid time '{}', expected epoch seconds or YYYY-MM-DD HH:MM:SS".format(value))
+
+#Method to read the comma separated event types of a log query, validated up front since streamed responses cannot report errors
+def logTypes(query):
+    types = [name for name in query.get('type', '').split(',') if name]
+    try:
+        LogQuery.typeFilter(types)
+    except ValueError as e:
+        raise RequestError(400, str(e))
+    return types
+
+#Fallback for every path without a registered handler
+def statusPage(request):
+    return (200, 'text/html', STATUS_PAGE_HEAD+"               <p>Clock: {}</p>".format(clockStatusText()).encode("utf-8")+STATUS_PAGE_TAIL)
+
+#Method to map a Blynk virtual pin to the relay's ESP32 digital pin
+def relayGPIO(pin):
+    try:
+        index = int(pin)
+    except ValueError:
+        raise RequestError(400, "Invalid virtual pin {}".format(pin))
+    if(index<0 or index>=len(config.RELAY_GPIO_PINS)):
+        raise RequestError(400, "Virtual pin {} is not a relay".format(pin))
+    return config.RELAY_GPIO_PINS[index]
+
+def relaySceneMessages(mask, states):
+    mask = int(mask)
+    states = int(states)
+    messages = []
+    for index in range(len(config.RELAY_GPIO_PINS)):
+        bit = 1<<index
+        if(mask & bit):
+            messages.append(config.RELAYSTATEMSG.format(index,config.RELAY_GPIO_PINS[index],1 if states & bit else 0)+" (scene)")
+    return messages
+
+#Log messages for every event the ESP32 reports, keyed by event code. Each formatter takes the event's data fields
+#in payload order and returns the lines to log. Used by the single event endpoints and by /ingest batches
+EVENT_FORMATTERS = {
+    config.EVENT_BLYNK_CONNECTED: lambda ping: ["ESP32 connected to Blynk with ping:"+str(ping)],
+    config.EVENT_BLYNK_DISCONNECTED: lambda: ["Critical: ESP32 has disconnected from blynk. Please check on priority"],
+    config.EVENT_RELAY: lambda pin, value: [config.RELAYSTATEMSG.format(pin,relayGPIO(pin),value)],
+    config.EVENT_RELAY_SCENE: relaySceneMessages,
+    config.EVENT_DHT_SUCCESS: lambda temp, hum: ["ESP32 received sensor readings from DHT11 and updated the sensor data to Blynk. (Temperature: {} Humidity: {})".format(temp,hum)],
+    config.EVENT_DHT_FAIL: lambda error: ["ESP32 could not read DHT11 sensor. Sensor returned error: {} Please check connection or if the sensor is faulty".format(error)],
+    config.EVENT_WEATHER_SUCCESS: lambda temp, hum, report, pressure: ["ESP32 received weather data from OpenWeather API and send data to Blynk cloud (Temperature = {} Humidity = {} Report = {} Pressure = {}".format(temp,hum,report,pressure)],
+    config.EVENT_WEATHER_FAIL: lambda code: ["ESP32 received error response code {} when trying to connect with OpenWeatherAPI. Blynk may not have the latest weather data due to this.".format(code)],
+    config.EVENT_EMAIL_SUCCESS: lambda: ["ESP32 has triggered a successful IFTT email event due to high temperature detection."],
+    config.EVENT_EMAIL_FAIL: lambda error: ["ESP32 has attempted to trigger an IFTT mail event but event has failed with status code: {} Due to this email has not been send".format(error)],
+    config.EVENT_DHT_SUMMARY: lambda tempMin, tempMax, tempMean, tempAvg, humMin, humMax, humMean, humAvg, samples: ["ESP32 sent a DHT11 summary of {} samples. (Temperature min={} max={} mean={} avg={} Humidity min={} max={} mean={} avg={})".format(samples,tempMin,tempMax,tempMean,tempAvg,humMin,humMax,humMean,humAvg)],
+}
+
+#Time series recorded for events carrying readings, one name per data field in payload order (None = not recorded)
+EVENT_SERIES = {
+    config.EVENT_DHT_SUCCESS: ('dht.temperature', 'dht.humidity'),
+    config.EVENT_WEATHER_SUCCESS: ('weather.temperature', 'weather.humidity', None, 'weather.pressure'),
+    config.EVENT_DHT_SUMMARY: ('dht.temperature.min', 'dht.temperature.max', 'dht.temperature', None,
+                               'dht.humidity.min', 'dht.humidity.max', 'dht.humidity', None, None),
+}
+
+def eventReadings(code, fields, epoch):
+    names = EVENT_SERIES.get(code, ())
+    return [(name, epoch, float(value)) for name, value in zip(names, fields) if name is not None]
+
+#Method to build the log lines for one event. epoch is when the event happened, defaults to now
+def eventLines(code, fields, epoch=None):
+    timestamp = getTimeFromAPI(epoch)
+    return [timestamp+message for message in EVENT_FORMATTERS[code](*fields)]
+
+#Method to store a board's readings, run them through the alert rules and push them to dashboards as kind events.
+#Series are stored as '<device id>/<series>'
+def recordReadings(device, readings, kind='reading'):
+    device.updateReadings(readings)
+    if(hub.clientCount()):
+        hub.publish(kind, {'device': device.id, 'time': max(reading[1] for reading in readings),
+                           'readings': dict((name, value) for name, epoch, value in readings)}, device.id)
+    readings = [(device.id+"/"+name, epoch, value) for name, epoch, value in readings]
+    readingStore.addMany(readings)
+    alertEngine.observe(readings)
+
+#Event types pushed to /events for board events that are not readings, keyed by event code
+STREAM_TYPES = {
+    config.EVENT_BLYNK_CONNECTED: 'connection',
+    config.EVENT_BLYNK_DISCONNECTED: 'connection',
+    config.EVENT_RELAY: 'relay',
+    config.EVENT_RELAY_SCENE: 'relay',
+    config.EVENT_DHT_FAIL: 'sensor_error',
+    config.EVENT_WEATHER_FAIL: 'sensor_error',
+}
+
+#Method to push a board event to dashboards. Relay events carry the board's full relay state after the change
+def publishEvent(device, code, fields, epoch):
+    kind = STREAM_TYPES.get(code)
+    if(kind is None or not hub.clientCount()):
+        return
+    data = {'device': device.id, 'time': epoch, 'code': code, 'fields': list(fields)}
+    if(kind=='relay'):
+        data['relays'] = list(device.relays)
+    elif(kind=='connection'):
+        data['connected'] = code==config.EVENT_BLYNK_CONNECTED
+    hub.publish(kind, data, device.id)
+
+#Method to log one event to the board's own log and update its state in the registry. The event is validated by
+#building its readings and lines and applying it to the board first, so a rejected event is never logged
+def logEvent(device, code, *fields):
+    epoch = clock.now()
+    readings = eventReadings(code, fields, epoch)
+    lines = eventLines(code, fields, epoch)
+    device.applyEvent(code, fields)
+    device.log.writeMany(lines)
+    publishEvent(device, code, fields, epoch)
+    if(readings):
+        recordReadings(device, readings)
+
+@route('/blynk-connection', board=True)
+def blynkConnection(request):
+    result = request.readJSON()
+    logEvent(request.device, config.EVENT_BLYNK_CONNECTED, result['ping_value'])
+
+@route('/highTempEmailSuccess', board=True)
+def highTempEmailSuccess(request):
+    logEvent(request.device, config.EVENT_EMAIL_SUCCESS)
+
+@route('/blynkDisconnect', board=True)
+def blynkDisconnect(request):
+    logEvent(request.device, config.EVENT_BLYNK_DISCONNECTED)
+
+@route('/highTempEmailFail', board=True)
+def highTempEmailFail(request):
+    result = request.readJSON()
+    logEvent(request.device, config.EVENT_EMAIL_FAIL, result['error'])
+
+@route('/updateWeatherFail', board=True)
+def updateWeatherFail(request):
+    result = request.readJSON()
+    logEvent(request.device, config.EVENT_WEATHER_FAIL, result['code'])
+
+@route('/updateDHTSuccess', board=True)
+def updateDHTSuccess(request):
+    result = request.readJSON()
+    logEvent(request.device, config.EVENT_DHT_SUCCESS, result['temp'], result['hum'])
+
+@route('/updateDHTFail', board=True)
+def updateDHTFail(request):
+    result = request.readJSON()
+    logEvent(request.device, config.EVENT_DHT_FAIL, result['error'])
+
+@route('/updateWeatherSuccess', board=True)
+def updateWeatherSuccess(request):
+    result = request.readJSON()
+    logEvent(request.device, config.EVENT_WEATHER_SUCCESS, result['temp'], result['hum'], result['report'], result['pressure'])
+
+@route('/updateRelayStatus', board=True)
+def updateRelayStatus(request):
+    result = request.readJSON()
+    logEvent(request.device, config.EVENT_RELAY, result['pin'], result['value'])
+
+@route('/updateRelayScene', board=True)
+def updateRelayScene(request):
+    result = request.readJSON()
+    logEvent(request.device, config.EVENT_RELAY_SCENE, result['mask'], result['states'])
+
+#Bulk event endpoint. Body is {"events": [[code, age in ms, data...], ...], "dropped": n}. The whole batch is decoded
+#first and written to the log in one go. Malformed events are skipped and counted instead of failing the batch, and
+#only events the board's state accepted are logged
+@route('/ingest', board=True)
+def ingest(request):
+    result = request.readJSON()
+    events = result['events']
+    if(not isinstance(events, list)):
+        raise RequestError(400, "events must be a list")
+    now = clock.now()
+    lines = []
+    readings = []
+    invalid = 0
+    for event in events:
+        try:
+            epoch = now-event[1]/1000.0
+            eventReadingList = eventReadings(event[0], event[2:], epoch)
+            eventLineList = eventLines(event[0], event[2:], epoch)
+            request.device.applyEvent(event[0], event[2:])
+            lines.extend(eventLineList)
+            publishEvent(request.device, event[0], event[2:], epoch)
+            readings.extend(eventReadingList)
+        except (KeyError, IndexError, TypeError, ValueError, RequestError):
+            invalid += 1
+    dropped = result.get('dropped', 0)
+    if(dropped):
+        lines.append(getTimeFromAPI(now)+"ESP32 event buffer overflowed. {} events were dropped before reaching the PI server".format(dropped))
+    if(invalid):
+        Metrics.malformedEvents.inc(amount=invalid)
+        lines.append(getTimeFromAPI(now)+"Skipped {} malformed events in batch from ESP32".format(invalid))
+    request.device.log.writeMany(lines)
+    if(readings):
+        recordReadings(request.device, readings)
+
+#Periodic health report from a board: heap, fragmentation, RSSI, reconnects, failed PI requests and callback latencies.
+#Kept in memory for /heartbeats, exported on /metrics and recorded as '<device id>/heartbeat.<field>' time series.
+#Boot phase timings are logged and recorded as '<device id>/boot.<phase>'
+@route('/heartbeat', board=True)
+def heartbeat(request):
+    try:
+        data = BoardHealth.parseHeartbeat(request.readJSON())
+    except (KeyError, ValueError, TypeError, AttributeError, ZeroDivisionError) as e:
+        raise RequestError(400, "Invalid heartbeat: {}".format(e))
+    device = request.device
+    epoch = clock.now()
+    if(heartbeats.add(device.id, epoch, data)):
+        device.log.write(getTimeFromAPI(epoch)+"ESP32 {} has restarted since its last heartbeat".format(device.id))
+    readings = []
+    for field in config.HEARTBEAT_FIELDS+('frag',):
+        Metrics.boardHealth.set(data[field], (device.id, field))
+        readings.append(("heartbeat."+field, epoch, data[field]))
+    for name, stats in data['cb'].items():
+        Metrics.boardCallbackMax.set(stats[2], (device.id, name))
+        readings.append(("heartbeat.cb.{}.mean".format(name), epoch, stats[1]))
+        readings.append(("heartbeat.cb.{}.max".format(name), epoch, stats[2]))
+    if('boot' in data):
+        device.log.write(getTimeFromAPI(epoch)+"ESP32 {} boot timings (ms since reset): {}".format(device.id, ", ".join("{} {:.0f}".format(phase, ms) for phase, ms in data['boot'].items())))
+        for phase, ms in data['boot'].items():
+            readings.append(("boot."+phase, epoch, ms))
+    recordReadings(device, readings, 'heartbeat')
+
+#Heartbeat history: /heartbeats?device=<id>&limit=N, or the latest heartbeat of every board without a device
+@route('/heartbeats')
+def heartbeatHistory(request):
+    query = request.query
+    deviceId = query.get('device')
+    if(deviceId is None):
+        return jsonResponse({'devices': heartbeats.latest()})
+    try:
+        limit = int(query['limit']) if 'limit' in query else None
+    except ValueError:
+        raise RequestError(400, "limit must be an integer")
+    return jsonResponse({'device': deviceId, 'heartbeats': heartbeats.history(deviceId, limit)})
+
+#Registered boards with relay states, latest readings and last-seen time: /devices, or /devices?id=<device id> for one
+@route('/devices')
+def deviceStatus(request):
+    deviceId = request.query.get('id')
+    if(deviceId is None):
+        return jsonResponse({'devices': [device.status() for device in devices.devices()]})
+    return jsonResponse(requestedDevice(deviceId).status())
+
+#Caching gateway for the ESP32: current weather as 'temperature|humidity|pressure|report', fetched from OpenWeather
+#at most once per config.WEATHER_CACHE_TTL for all boards. Upstream failures answer 502 with the upstream status code as body
+@route('/weather', board=True)
+def weather(request):
+    try:
+        return (200, 'text/plain; charset=utf-8', WeatherGateway.weatherPayload())
+    except WeatherGateway.UpstreamError as e:
+        return (502, 'text/plain', str(e.status).encode("utf-8"))
+
+#Local time for the ESP32 RTC from the WorldTimeAPI synced clock as 'YYYY-MM-DD HH:MM:SS|weekday', Monday = 0 as machine.RTC expects.
+#Answers 503 until the clock has synced so the board falls back to WorldTimeAPI itself
+@route('/time', board=True)
+def localTime(request):
+    if(clock.lastSync is None):
+        return (503, 'text/plain', b'Clock not synced')
+    now = clock.localtime()
+    return (200, 'text/plain', "{}|{}".format(time.strftime("%Y-%m-%d %H:%M:%S", now), now.tm_wday).encode("utf-8"))
+
+def requestedDevice(deviceId):
+    device = devices.get(deviceId)
+    if(device is None):
+        raise RequestError(404, "Unknown device '{}'".format(deviceId))
+    return device
+
+#Method to pick the log a query is about: the board's own log with ?device=<id>, otherwise the server log
+#(ESP32.log, alerts). Pending lines are flushed first so the query sees them. Returns the LogQuery
+def requestedLog(query):
+    deviceId = query.get('device')
+    if(deviceId is None):
+        esp32Log.flush()
+        return logQuery
+    device = requestedDevice(deviceId)
+    device.log.flush()
+    return device.logQuery
+
+#Time range slice of a log and its rotated segments: /log?device=<id>&from=...&to=...&type=relay,dht
+#Streamed in chunks, rotated segments outside the range are skipped and the rest are entered through the sparse index
+@route('/log')
+def logRange(request):
+    query = request.query
+    types = logTypes(query)
+    start = logTimeKey(query.get('from'))
+    end = logTimeKey(query.get('to'))
+    return (200, 'text/plain; charset=utf-8', requestedLog(query).range(start, end, types))
+
+#Follow streams running now. Each holds a worker for up to config.LOG_TAIL_MAX_SECONDS, so only the server's
+#maxLogFollowers may run at once and boards always keep free workers
+logFollowers = 0
+logFollowersLock = threading.Lock()
+
+#A /log/tail follow stream which frees its place when the response closes it
+class LogFollower:
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __iter__(self):
+        return self.lines
+
+    def close(self):
+        global logFollowers
+        if(self.lines is None):
+            return
+        self.lines.close()
+        self.lines = None
+        with logFollowersLock:
+            logFollowers -= 1
+
+#Method to take a follower place, False when the server already runs as many follow streams as it allows
+def startFollower(limit):
+    global logFollowers
+    with logFollowersLock:
+        if(logFollowers>=limit):
+            return False
+        logFollowers += 1
+        return True
+
+#Last lines of a log: /log/tail?device=<id>&lines=50&type=blynk. With follow=1 new lines keep streaming for up to config.LOG_TAIL_MAX_SECONDS
+@route('/log/tail')
+def logTail(request):
+    query = request.query
+    types = logTypes(query)
+    try:
+        count = int(query.get('lines', 50))
+    except ValueError:
+        raise RequestError(400, "Invalid lines '{}', expected a number of lines".format(query['lines']))
+    count = max(1, min(count, config.LOG_TAIL_MAX_LINES))
+    log = requestedLog(query)
+    if(query.get('follow') in ('1', 'true', 'yes')):
+        limit = getattr(request.server, 'maxLogFollowers', config.LOG_TAIL_MAX_FOLLOWERS)
+        if(not startFollower(limit)):
+            raise RequestError(503, "Too many /log/tail followers, this server allows {} at once".format(limit))
+        return (200, 'text/plain; charset=utf-8', LogFollower(log.follow(count, types=types)))
+    return (200, 'text/plain; charset=utf-8', log.last(count, types)[0])
+
+#Range query over the reading rollups: /series?name=<device id>/dht.temperature&resolution=hour&from=...&to=...
+#Without a name it lists the recorded series. Defaults to the last day at hourly resolution
+@route('/series')
+def series(request):
+    query = request.query
+    name = query.get('name')
+    if(not name):
+        return jsonResponse({'series': readingStore.seriesNames()})
+    now = time.time()
+    end = parseTime(query.get('to'), now)
+    start = parseTime(query.get('from'), end-86400)
+    resolution = query.get('resolution', 'hour')
+    try:
+        points = readingStore.query(name, start, end, resolution)
+    except ValueError as e:
+        raise RequestError(400, str(e))
+    return jsonResponse({'series': name, 'resolution': resolution, 'fields': ['start', 'count', 'mean', 'min', 'max'], 'points': points})
+
+#Live event stream for dashboards (Server-Sent Events): /events?types=relay,reading&device=<id>, both filters optional.
+#Starts with a 'snapshot' event holding /devices, then pushes relay, reading, heartbeat, connection, sensor_error and
+#alert events as they arrive. The connection is handed to the EventHub's writer thread, so it does not hold a worker
+@route('/events')
+def eventStream(request):
+    query = request.query
+    types = None
+    if(query.get('types')):
+        types = set(query['types'].split(','))
+        unknown = types-EVENT_STREAM_TYPES
+        if(unknown):
+            raise RequestError(400, "Unknown event types {}, expected some of {}".format(", ".join(sorted(unknown)), ", ".join(sorted(EVENT_STREAM_TYPES))))
+    if(hub.clientCount()>=hub.maxClients):
+        raise RequestError(503, "Too many dashboards connected")
+    snapshot = "event: snapshot\ndata: {}\n\n".format(json.dumps({'devices': [device.status() for device in devices.devices()]}))
+    request.send_response(200)
+    request.send_header('Content-type', 'text/event-stream')
+    request.send_header('Cache-Control', 'no-cache')
+    request.end_headers()
+    request.detach()
+    try:
+        hub.subscribe(request.connection, types, query.get('device'), snapshot.encode("utf-8"))
+    except EventHub.HubFull:
+        detachedConnections.discard(request.connection)
+    return DETACHED
+
+EVENT_STREAM_TYPES = {'snapshot', 'relay', 'reading', 'heartbeat', 'connection', 'sensor_error', 'alert'}
+
+#Active alerts and the most recent alert state changes
+@route('/alerts')
+def alerts(request):
+    return jsonResponse(alertEngine.status())
+
+#Prometheus scrape endpoint: request counts and latencies per route, log write cost, timestamp cost, JSON decode
+#failures and when each board was last seen
+@route('/metrics')
+def metrics(request):
+    return (200, 'text/plain; version=0.0.4; charset=utf-8', Metrics.render())
+
+
+#Leaves connections handed over with MyServer.detach open when their request finishes
+class DetachMixin:
+
+    def shutdown_request(self, request):
+        if(request in detachedConnections):
+            detachedConnections.discard(request)
+            return
+        super().shutdown_request(request)
+
+class ThreadedHTTPServer(DetachMixin, ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = config.SERVER_LISTEN_BACKLOG
+
+#Serves one connection at a time, so every response closes the connection rather than wait on an idle board
+class SingleHTTPServer(DetachMixin, HTTPServer):
+    idleConnections = 'close'
+    #A follow stream would hold the only thread, so /log/tail?follow=1 is refused
+    maxLogFollowers = 0
+    request_queue_size = config.SERVER_LISTEN_BACKLOG
+
+#HTTP server which hands accepted connections to a fixed pool of worker threads through a bounded queue.
+#A slow request (slow client, SD card write) only blocks its own worker instead of every ESP32 call.
+#Between requests a keep-alive connection holds no worker: it is parked in a selector watched by one thread and
+#queued again when the board sends its next request, or closed after config.KEEPALIVE_TIMEOUT seconds
+class ThreadPoolHTTPServer(DetachMixin, HTTPServer):
+
+    idleConnections = 'park'
+    request_queue_size = config.SERVER_LISTEN_BACKLOG
+
+    def __init__(self, server_address, RequestHandlerClass, workers=config.SERVER_WORKERS, queue_size=config.SERVER_QUEUE_SIZE):
+        HTTPServer.__init__(self, server_address, RequestHandlerClass)
+        self.pending = queue.Queue(queue_size)
+        #Follow streams may take at most a quarter of the workers
+        self.maxLogFollowers = min(config.LOG_TAIL_MAX_FOLLOWERS, workers//4)
+        #Parked handlers by socket, with the monotonic time they are closed at
+        self._idle = {}
+        self._idleLock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._wakeRead, self._wakeWrite = socket.socketpair()
+        self._wakeRead.setblocking(False)
+        self._wakeWrite.setblocking(False)
+        self._selector.register(self._wakeRead, selectors.EVENT_READ)
+        self._watching = True
+        self._watcher = threading.Thread(target=self._watchIdle, name="http-idle", daemon=True)
+        self._watcher.start()
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._worker, name="http-worker-{}".format(i), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    #Items are new connections as (socket, address) or parked handlers whose client sent its next request
+    def _worker(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            handler = None
+            if(isinstance(item, tuple)):
+                request, client_address = item
+            else:
+                request, client_address = item.connection, item.client_address
+            try:
+                if(isinstance(item, tuple)):
+                    handler = self.finish_request(request, client_address)
+                else:
+                    handler = item.resume()
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                if(handler is not None and handler.idle):
+                    self.park(handler)
+                else:
+                    self.shutdown_request(request)
+
+    #Method to watch an idle keep-alive connection until the client sends its next request
+    def park(self, handler):
+        with self._idleLock:
+            if(not self._watching):
+                handler.closeIdle()
+                self.shutdown_request(handler.connection)
+                return
+            self._idle[handler.connection] = (handler, time.monotonic()+config.KEEPALIVE_TIMEOUT)
+            self._selector.register(handler.connection, selectors.EVENT_READ, handler)
+        try:
+            self._wakeWrite.send(b"\0")
+        except OSError:
+            pass
+
+    def _unpark(self, sock):
+        handler, deadline = self._idle.pop(sock)
+        self._selector.unregister(sock)
+        return handler
+
+    def _closeIdle(self, handler):
+        handler.closeIdle()
+        self.shutdown_request(handler.connection)
+
+    def _watchIdle(self):
+        while self._watching:
+            events = self._selector.select(1)
+            ready = []
+            expired = []
+            with self._idleLock:
+                for key, mask in events:
+                    if(key.fileobj is self._wakeRead):
+                        try:
+                            while self._wakeRead.recv(4096):
+                                pass
+                        except (BlockingIOError, InterruptedError):
+                            pass
+                    elif(key.fileobj in self._idle):
+                        ready.append(self._unpark(key.fileobj))
+                now = time.monotonic()
+                for sock, (handler, deadline) in list(self._idle.items()):
+                    if(deadline<=now):
+                        expired.append(self._unpark(sock))
+            for handler in expired:
+                self._closeIdle(handler)
+            for handler in ready:
+                try:
+                    self.pending.put_nowait(handler)
+                except queue.Full:
+                    #Every worker is busy and the backlog is full. The board retries on a new connection
+                    self._closeIdle(handler)
+
+    def process_request(self, request, client_address):
+        try:
+            self.pending.put((request, client_address), timeout=config.SERVER_QUEUE_TIMEOUT)
+        except queue.Full:
+            #All workers busy and the backlog is full. Refuse quickly so the ESP32 does not hang on its socket
+            try:
+                request.sendall(b"HTTP/1.0 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        with self._idleLock:
+            self._watching = False
+            parked = [self._unpark(sock) for sock in list(self._idle)]
+        for handler in parked:
+            self._closeIdle(handler)
+        self._wakeWrite.send(b"\0")
+        self._watcher.join(1)
+        self._selector.close()
+        for worker in self.workers:
+            self.pending.put(None)
+        for worker in self.workers:
+            worker.join(1)
+
+#Pool server for one worker process in 'prefork' mode. Every worker binds the same port, the kernel spreads
+#new connections over them
+class PreforkHTTPServer(ThreadPoolHTTPServer):
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        ThreadPoolHTTPServer.server_bind(self)
+
+#Method to build the HTTP server for the serving mode selected in config.py
+def createServer(mode=config.SERVER_MODE):
+    address = (config.HOST_NAME, config.HOST_PORT)
+    if(mode=='pool'):
+        return ThreadPoolHTTPServer(address, MyServer)
+    if(mode=='threaded'):
+        return ThreadedHTTPServer(address, MyServer)
+    if(mode=='single'):
+        return SingleHTTPServer(address, MyServer)
+    if(mode=='prefork'):
+        return PreforkHTTPServer(address, MyServer)
+    raise ValueError("Unknown SERVER_MODE '{}' in config.py".format(mode))
+
+#Method to serve requests in one 'prefork' worker process until it is sent SIGTERM by Prefork.serve
+def serveWorker(index):
+    clock.start()
+    hub.start()
+    http_server = createServer('prefork')
+    #shutdown() waits for serve_forever to return, so it cannot run on the thread the signal interrupts
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=http_server.shutdown).start())
+    http_server.serve_forever()
+    http_server.server_close()
+    clock.stop()
+    hub.stop()
+    readingStore.close()
+
+def stopOnSignal(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def main():
+    if(config.SERVER_MODE=='prefork'):
+        print("Server Starts - %s:%s (mode: prefork, %s workers)" % (config.HOST_NAME, config.HOST_PORT, config.PREFORK_WORKERS))
+        Prefork.serve(serveWorker)
+        return
+    clock.start()
+    alertEngine.start()
+    hub.start()
+    http_server = createServer()
+    #systemd stops the service with SIGTERM. Run the same shutdown as Ctrl+C so buffered log lines are written
+    signal.signal(signal.SIGTERM, stopOnSignal)
+    print("Server Starts - %s:%s (mode: %s)" % (config.HOST_NAME, config.HOST_PORT, config.SERVER_MODE))
 
     try:
         http_server.serve_forever()
     except KeyboardInterrupt:
         http_server.server_close()
+        clock.stop()
+        alertEngine.stop()
+        hub.stop()
+        esp32Log.close()
+        devices.close()
+        readingStore.close()
+
+
+# # # # # Main # # # # #
+
+if __name__ == '__main__':
+    main()
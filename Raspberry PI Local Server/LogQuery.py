@@ -0,0 +1,315 @@
+import os
+import re
+import gzip
+import mmap
+import time
+import bisect
+import collections
+import threading
+
+import config
+
+#Every log line starts with a 'YYYY-MM-DD HH:MM:SS' timestamp. Timestamps in that layout sort the same as strings,
+#so the index and the range filter compare the raw 19 byte prefix instead of parsing dates
+TIMESTAMP = re.compile(rb"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d")
+KEY_LENGTH = 19
+
+#Substrings identifying each event type in the log lines written by LocalWebServer
+EVENT_TYPES = {
+    'relay': (b'Relay State',),
+    'dht': (b'DHT11',),
+    'weather': (b'OpenWeather',),
+    'blynk': (b'Blynk', b'blynk'),
+    'disconnect': (b'disconnected from blynk',),
+    'email': (b'IFTT',),
+    'buffer': (b'event buffer', b'malformed events'),
+    'restart': (b'restarted since its last heartbeat',),
+    'alert': (b'Alert ',),
+}
+
+def lineKey(line):
+    if(TIMESTAMP.match(line)):
+        return line[:KEY_LENGTH]
+    return None
+
+#Method to shift a 'YYYY-MM-DD HH:MM:SS' key by a number of seconds
+def shiftKey(key, seconds):
+    epoch = time.mktime(time.strptime(key.decode(), "%Y-%m-%d %H:%M:%S"))+seconds
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(epoch)).encode()
+
+#Method to build a line filter for a set of event type names. Returns None when every line matches
+def typeFilter(types):
+    if(not types):
+        return None
+    patterns = []
+    for name in types:
+        if(name not in EVENT_TYPES):
+            raise ValueError("Unknown event type '{}', expected one of {}".format(name, ", ".join(sorted(EVENT_TYPES))))
+        patterns.extend(EVENT_TYPES[name])
+    return lambda line: any(pattern in line for pattern in patterns)
+
+#Sparse timestamp to offset index for one plain log segment. An entry is taken at the first line starting after
+#every config.LOG_INDEX_STRIDE bytes, so a range query bisects the index and reads from a nearby offset.
+#Lines can be slightly out of order (batched ESP32 events carry their own time), which is covered by the slack
+#window in LogQuery. The index of the live log is extended as it grows and rebuilt when it is rotated.
+class SegmentIndex:
+
+    def __init__(self, path, stride=config.LOG_INDEX_STRIDE):
+        self.path = path
+        self.stride = stride
+        self.inode = None
+        self.size = 0
+        self.keys = []
+        self.offsets = []
+        self.firstKey = None
+        self.lastKey = None
+
+    #Method to bring the index up to date with the file on disk
+    def refresh(self):
+        stat = os.stat(self.path)
+        if(stat.st_ino!=self.inode or stat.st_size<self.size):
+            self.inode = stat.st_ino
+            self.size = 0
+            self.keys = []
+            self.offsets = []
+            self.firstKey = None
+            self.lastKey = None
+        if(stat.st_size==self.size):
+            return
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            #Only index complete lines, a partially flushed last line is picked up next time
+            end = mm.rfind(b"\n", self.size, size)+1
+            if(end<=self.size):
+                return
+            position = self.size
+            nextEntry = self.offsets[-1]+self.stride if self.offsets else 0
+            while position<end:
+                lineEnd = mm.find(b"\n", position, end)+1
+                key = lineKey(mm[position:position+KEY_LENGTH])
+                if(key is not None):
+                    if(self.firstKey is None):
+                        self.firstKey = key
+                    if(self.lastKey is None or key>self.lastKey):
+                        self.lastKey = key
+                    if(position>=nextEntry):
+                        self.keys.append(key)
+                        self.offsets.append(position)
+                        nextEntry = position+self.stride
+                position = lineEnd
+            self.size = end
+
+    #Offset of an indexed line at or before the first line with a timestamp >= key
+    def seek(self, key):
+        index = bisect.bisect_left(self.keys, key)-1
+        if(index<0):
+            return 0
+        return self.offsets[index]
+
+    #Method to yield complete lines from offset onwards, read through a memory map
+    def lines(self, offset=0):
+        with open(self.path, "rb") as f:
+            #The live log may have been rotated and replaced by an empty file since the last refresh
+            if(self.size==0 or os.fstat(f.fileno()).st_size==0):
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with mm:
+            end = min(self.size, len(mm))
+            position = offset
+            while position<end:
+                lineEnd = mm.find(b"\n", position, end)+1
+                if(lineEnd==0):
+                    lineEnd = end
+                yield mm[position:lineEnd]
+                position = lineEnd
+
+#Queries over ESP32.log and its rotated segments (<name>.N[.gz], see LogWriter). Plain segments are read through
+#a SegmentIndex, gzipped segments are streamed and skipped entirely when their first and last timestamps fall
+#outside the requested range. Results are yielded in chunks of about config.LOG_STREAM_CHUNK bytes.
+class LogQuery:
+
+    def __init__(self, path, backupCount=config.LOG_ROTATE_BACKUP_COUNT, slack=config.LOG_INDEX_SLACK,
+                 chunkSize=config.LOG_STREAM_CHUNK):
+        self.path = path
+        self.backupCount = backupCount
+        self.slack = slack
+        self.chunkSize = chunkSize
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._packedBounds = {}
+
+    #Segments oldest first, ending with the live log
+    def segments(self):
+        found = []
+        for index in range(self.backupCount, 0, -1):
+            for name in ("{}.{}.gz".format(self.path, index), "{}.{}".format(self.path, index)):
+                if(os.path.exists(name)):
+                    found.append(name)
+        if(os.path.exists(self.path)):
+            found.append(self.path)
+        return found
+
+    def _index(self, path):
+        with self._lock:
+            index = self._indexes.get(path)
+            if(index is None):
+                index = self._indexes[path] = SegmentIndex(path)
+            index.refresh()
+            return index
+
+    #First and last timestamp of a gzipped segment, computed once since rotated segments never change
+    def _bounds(self, path):
+        stat = os.stat(path)
+        cacheKey = (stat.st_ino, stat.st_mtime, stat.st_size)
+        with self._lock:
+            cached = self._packedBounds.get(path)
+        if(cached is not None and cached[0]==cacheKey):
+            return cached[1], cached[2]
+        first = last = None
+        with gzip.open(path, "rb") as f:
+            for line in f:
+                key = lineKey(line)
+                if(key is not None):
+                    if(first is None):
+                        first = key
+                    if(last is None or key>last):
+                        last = key
+        with self._lock:
+            self._packedBounds[path] = (cacheKey, first, last)
+        return first, last
+
+    def _segmentLines(self, path, start, end):
+        if(path.endswith(".gz")):
+            first, last = self._bounds(path)
+            if(first is None or (start is not None and last<start) or (end is not None and first>end)):
+                return
+            with gzip.open(path, "rb") as f:
+                for line in f:
+                    yield line
+            return
+        index = self._index(path)
+        if(index.firstKey is None or (start is not None and index.lastKey<start) or (end is not None and index.firstKey>end)):
+            return
+        seekKey = shiftKey(start, -self.slack) if start is not None else None
+        stopKey = shiftKey(end, self.slack) if end is not None else None
+        offset = index.seek(seekKey) if seekKey is not None else 0
+        for line in index.lines(offset):
+            key = lineKey(line)
+            if(stopKey is not None and key is not None and key>stopKey):
+                return
+            yield line
+
+    #Method to stream log lines with timestamps in [start, end], both 'YYYY-MM-DD HH:MM:SS' bytes or None for open ended.
+    #Lines without a timestamp are kept with the line before them
+    def range(self, start=None, end=None, types=None):
+        match = typeFilter(types)
+        chunk = []
+        chunkBytes = 0
+        for path in self.segments():
+            key = None
+            for line in self._segmentLines(path, start, end):
+                key = lineKey(line) or key
+                if(key is None or (start is not None and key<start) or (end is not None and key>end)):
+                    continue
+                if(match is not None and not match(line)):
+                    continue
+                chunk.append(line)
+                chunkBytes += len(line)
+                if(chunkBytes>=self.chunkSize):
+                    yield b"".join(chunk)
+                    chunk = []
+                    chunkBytes = 0
+        if(chunk):
+            yield b"".join(chunk)
+
+    #Method to get the last count matching lines, reading the live log backwards through a memory map and moving on
+    #to older segments if it is too short. Returns the lines and the offset the live log was read up to
+    def last(self, count, types=None):
+        match = typeFilter(types)
+        found = []
+        end = self._liveEnd()
+        for path in reversed(self.segments()):
+            if(len(found)>=count):
+                break
+            if(path.endswith(".gz")):
+                newest = collections.deque(maxlen=count-len(found))
+                with gzip.open(path, "rb") as f:
+                    for line in f:
+                        if(match is None or match(line)):
+                            newest.append(line)
+                found.extend(reversed(newest))
+                continue
+            with open(path, "rb") as f:
+                if(os.fstat(f.fileno()).st_size==0):
+                    continue
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            with mm:
+                position = mm.rfind(b"\n")+1
+                if(path==self.path):
+                    end = position
+                while position>0 and len(found)<count:
+                    lineStart = mm.rfind(b"\n", 0, position-1)+1
+                    line = mm[lineStart:position]
+                    if(match is None or match(line)):
+                        found.append(line)
+                    position = lineStart
+        found.reverse()
+        return b"".join(found), end
+
+    #Method to find the offset just past the last complete line of the live log, reading back from its end
+    def _liveEnd(self):
+        try:
+            with open(self.path, "rb") as f:
+                position = os.fstat(f.fileno()).st_size
+                while position>0:
+                    start = max(0, position-self.chunkSize)
+                    f.seek(start)
+                    newline = f.read(position-start).rfind(b"\n")
+                    if(newline>=0):
+                        return start+newline+1
+                    position = start
+        except FileNotFoundError:
+            pass
+        return 0
+
+    #Method to stream the last count lines and then every line appended after them, polling the live log every
+    #config.LOG_TAIL_POLL_INTERVAL seconds for at most duration seconds. Follows the log across rotation
+    def follow(self, count, duration=config.LOG_TAIL_MAX_SECONDS, types=None):
+        match = typeFilter(types)
+        data, position = self.last(count, types)
+        if(data):
+            yield data
+        inode = os.stat(self.path).st_ino if os.path.exists(self.path) else None
+        deadline = time.monotonic()+duration
+        while time.monotonic()<deadline:
+            time.sleep(config.LOG_TAIL_POLL_INTERVAL)
+            #Empty chunk on every poll so the server notices a client that has gone away
+            yield b""
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                continue
+            if(stat.st_ino!=inode or stat.st_size<position):
+                inode = stat.st_ino
+                position = 0
+            if(stat.st_size==position):
+                continue
+            #Read in config.LOG_STREAM_CHUNK pieces, a rotation can leave a whole segment of new lines
+            with open(self.path, "rb") as f:
+                f.seek(position)
+                remaining = stat.st_size-position
+                partial = b""
+                while remaining>0:
+                    data = f.read(min(self.chunkSize, remaining))
+                    if(not data):
+                        break
+                    remaining -= len(data)
+                    data = partial+data
+                    complete = data.rfind(b"\n")+1
+                    partial = data[complete:]
+                    position += complete
+                    lines = data[:complete].splitlines(True)
+                    if(match is not None):
+                        lines = [line for line in lines if match(line)]
+                    if(lines):
+                        yield b"".join(lines)
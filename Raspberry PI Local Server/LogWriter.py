@@ -0,0 +1,172 @@
+import os
+import gzip
+import shutil
+import time
+import threading
+
+import config
+import Metrics
+
+#Buffered, rotating writer for the ESP32 log. Request handlers only append lines to an in-memory buffer,
+#a background thread writes them out in batches (when config.LOG_BATCH_SIZE lines are waiting or every
+#config.LOG_FLUSH_INTERVAL seconds), applies the fsync policy and rotates the file by size or age.
+#Rotated segments are kept as <name>.1 (newest) .. <name>.<LOG_ROTATE_BACKUP_COUNT>, optionally gzipped.
+class LogWriter:
+
+    FSYNC_POLICIES = ('never', 'batch', 'interval')
+
+    def __init__(self, path, batchSize=config.LOG_BATCH_SIZE, flushInterval=config.LOG_FLUSH_INTERVAL,
+                 maxPending=config.LOG_MAX_PENDING, fsyncPolicy=config.LOG_FSYNC_POLICY,
+                 fsyncInterval=config.LOG_FSYNC_INTERVAL, maxBytes=config.LOG_ROTATE_MAX_BYTES,
+                 rotateInterval=config.LOG_ROTATE_INTERVAL, backupCount=config.LOG_ROTATE_BACKUP_COUNT,
+                 compress=config.LOG_ROTATE_COMPRESS):
+        if(fsyncPolicy not in self.FSYNC_POLICIES):
+            raise ValueError("Unknown LOG_FSYNC_POLICY '{}' in config.py".format(fsyncPolicy))
+        self.path = path
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.maxPending = maxPending
+        self.fsyncPolicy = fsyncPolicy
+        self.fsyncInterval = fsyncInterval
+        self.maxBytes = maxBytes
+        self.rotateInterval = rotateInterval
+        self.backupCount = backupCount
+        self.compress = compress
+        self.metricLabel = os.path.basename(path)
+        self._pending = []
+        self._flushedSeq = 0
+        self._writtenSeq = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._file = None
+        self._lastFsync = time.monotonic()
+        self._open()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    #Method to queue one log line. Blocks only when the flusher is more than maxPending lines behind. If the flusher
+    #thread is gone the lines are dropped and counted instead, so request handlers never wait on it forever
+    def write(self, line):
+        self.writeMany((line,))
+
+    #Method to queue several log lines in one go, keeping them together in the file
+    def writeMany(self, lines):
+        with self._cond:
+            if(self._closed):
+                raise ValueError("write to closed LogWriter for {}".format(self.path))
+            while len(self._pending)>=self.maxPending:
+                if(not self._thread.is_alive()):
+                    Metrics.logDroppedLines.inc((self.metricLabel,), len(lines))
+                    return
+                self._cond.notify_all()
+                self._cond.wait(self.flushInterval)
+            for line in lines:
+                self._pending.append(line+"\n")
+            self._writtenSeq += len(lines)
+            if(len(self._pending)>=self.batchSize):
+                self._cond.notify_all()
+
+    #Method to wait until everything queued so far has been written to the file
+    def flush(self):
+        with self._cond:
+            target = self._writtenSeq
+            self._cond.notify_all()
+            while self._flushedSeq<target and self._thread.is_alive():
+                self._cond.wait(self.flushInterval)
+
+    #Method to drain the buffer, stop the flusher thread and close the file
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _open(self):
+        self._file = open(self.path, "a")
+        self._segmentStart = time.time()
+        if(self._file.tell()>0):
+            self._segmentStart = os.stat(self.path).st_mtime
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if(len(self._pending)<self.batchSize and not self._closed):
+                    self._cond.wait(self.flushInterval)
+                batch = self._pending
+                self._pending = []
+                closing = self._closed
+                self._cond.notify_all()
+            if(batch):
+                try:
+                    self._writeBatch(batch)
+                except Exception as e:
+                    #A full SD card or a failed rotation loses this batch, not the writer. The next batch reopens the file
+                    Metrics.logWriteErrors.inc((self.metricLabel,))
+                    Metrics.logDroppedLines.inc((self.metricLabel,), len(batch))
+                    print("Unable to write {} lines to {}: {}".format(len(batch), self.path, e))
+            with self._cond:
+                self._flushedSeq += len(batch)
+                self._cond.notify_all()
+            if(closing and not batch):
+                break
+        if(self._file is not None):
+            self._file.close()
+
+    def _writeBatch(self, batch):
+        started = time.perf_counter()
+        if(self._file is None):
+            self._open()
+        offset = self._file.tell()
+        self._file.write("".join(batch))
+        self._file.flush()
+        now = time.monotonic()
+        if(self.fsyncPolicy=='batch' or (self.fsyncPolicy=='interval' and now-self._lastFsync>=self.fsyncInterval)):
+            os.fsync(self._file.fileno())
+            self._lastFsync = now
+        Metrics.logWriteLatency.observe(time.perf_counter()-started, (self.metricLabel,))
+        Metrics.logBytes.inc((self.metricLabel,), self._file.tell()-offset)
+        Metrics.logLines.inc((self.metricLabel,), len(batch))
+        if(self._shouldRotate()):
+            self._rotate()
+
+    def _shouldRotate(self):
+        if(self.maxBytes and self._file.tell()>=self.maxBytes):
+            return True
+        if(self.rotateInterval and time.time()-self._segmentStart>=self.rotateInterval):
+            return True
+        return False
+
+    #Method to name a rotated segment, index 1 being the newest
+    def segmentName(self, index, compressed=False):
+        name = "{}.{}".format(self.path, index)
+        if(compressed):
+            name = name+".gz"
+        return name
+
+    def _rotate(self):
+        if(self.fsyncPolicy!='never'):
+            os.fsync(self._file.fileno())
+        self._file.close()
+        #Left unset until the file is open again, so a failure below is retried by the next batch
+        self._file = None
+        if(self.backupCount>0):
+            for compressed in (False, True):
+                oldest = self.segmentName(self.backupCount, compressed)
+                if(os.path.exists(oldest)):
+                    os.remove(oldest)
+            for index in range(self.backupCount-1, 0, -1):
+                for compressed in (False, True):
+                    source = self.segmentName(index, compressed)
+                    if(os.path.exists(source)):
+                        os.replace(source, self.segmentName(index+1, compressed))
+            os.replace(self.path, self.segmentName(1))
+            if(self.compress):
+                self._compress(self.segmentName(1))
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def _compress(self, source):
+        with open(source, "rb") as plain, gzip.open(source+".gz", "wb") as packed:
+            shutil.copyfileobj(plain, packed)
+        os.remove(source)
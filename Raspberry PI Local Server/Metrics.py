@@ -0,0 +1,125 @@
+import bisect
+import threading
+
+#Minimal in-process metrics in the Prometheus text exposition format, served by LocalWebServer on /metrics.
+#Each metric keeps one value (or bucket array) per label combination in a dict guarded by its own lock, so recording
+#is a dict lookup and an addition. Label values are passed as a tuple in the order of the metric's label names.
+REGISTRY = []
+
+#Default latency buckets in seconds, from sub-millisecond handler times up to slow upstream calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def escapeLabel(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def formatLabels(names, values, extra=""):
+    pairs = ['{}="{}"'.format(name, escapeLabel(value)) for name, value in zip(names, values)]
+    if(extra):
+        pairs.append(extra)
+    if(not pairs):
+        return ""
+    return "{"+",".join(pairs)+"}"
+
+def formatValue(value):
+    if(value==float("inf")):
+        return "+Inf"
+    if(isinstance(value, float) and value.is_integer()):
+        return str(int(value))
+    return repr(value)
+
+class Metric:
+
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append("{}{} {}".format(self.name, formatLabels(self.labels, labels), formatValue(value)))
+        return lines
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0)+amount
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    #Method to record one observation. Per label combination the value is [count per bucket (last = +Inf), sum]
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if(entry is None):
+                entry = self._values[labels] = [[0]*(len(self.buckets)+1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.kind)]
+        with self._lock:
+            items = sorted((labels, (list(entry[0]), entry[1])) for labels, entry in self._values.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets+(float("inf"),), counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(self.name, formatLabels(self.labels, labels, 'le="{}"'.format(formatValue(float(bound)))), cumulative))
+            lines.append("{}_sum{} {}".format(self.name, formatLabels(self.labels, labels), repr(total)))
+            lines.append("{}_count{} {}".format(self.name, formatLabels(self.labels, labels), cumulative))
+        return lines
+
+#Method to render every registered metric as a Prometheus text exposition
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return ("\n".join(lines)+"\n").encode("utf-8")
+
+#Metrics shared by the server modules
+requestCount = Counter('pi_http_requests_total', "HTTP requests handled, by route and status code", ('route', 'status'))
+requestLatency = Histogram('pi_http_request_duration_seconds', "Time from dispatch to the last byte of the response, by route", ('route',))
+timestampLatency = Histogram('pi_timestamp_duration_seconds', "Time spent in getTimeFromAPI building log timestamps",
+                             buckets=(0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001))
+clockSyncLatency = Histogram('pi_worldtimeapi_sync_duration_seconds', "Duration of WorldTimeAPI clock syncs, by result", ('result',))
+logWriteLatency = Histogram('pi_log_write_duration_seconds', "Time to write (and fsync, per policy) one batch of log lines", ('log',))
+logBytes = Counter('pi_log_bytes_written_total', "Bytes written to log files", ('log',))
+logLines = Counter('pi_log_lines_written_total', "Lines written to log files", ('log',))
+logWriteErrors = Counter('pi_log_write_errors_total', "Log batches that failed to write or rotate, by log", ('log',))
+logDroppedLines = Counter('pi_log_dropped_lines_total', "Log lines lost to write errors or a stopped writer, by log", ('log',))
+jsonFailures = Counter('pi_json_decode_failures_total', "Request bodies that were not a valid JSON object, by route", ('route',))
+malformedEvents = Counter('pi_ingest_malformed_events_total', "Events skipped in /ingest batches because they could not be decoded")
+boardLastSeen = Gauge('pi_board_last_seen_timestamp_seconds', "Unix time of the last request from each board", ('board',))
+boardHealth = Gauge('pi_board_heartbeat', "Latest heartbeat value reported by each board, by field", ('board', 'field'))
+boardCallbackMax = Gauge('pi_board_callback_max_microseconds', "Slowest run of each ESP32 callback in the last heartbeat window", ('board', 'callback'))
+alerts = Counter('pi_alerts_total', "Alert state changes, by rule and state (firing, resolved, suppressed)", ('rule', 'state'))
+alertsSuppressed = Counter('pi_alerts_suppressed_total', "Alerts not sent, by rule and reason (duplicate, cooldown, queue_full)", ('rule', 'reason'))
+alertFailures = Counter('pi_alert_delivery_failures_total', "Alerts the notifier failed to deliver, by rule", ('rule',))
+sseClients = Gauge('pi_sse_clients', "Dashboards connected to /events")
+sseEvents = Counter('pi_sse_events_total', "Events published to /events subscribers, by type", ('type',))
+sseDropped = Counter('pi_sse_dropped_total', "Dashboards disconnected from /events, by reason (slow, closed, shutdown)", ('reason',))
@@ -0,0 +1,222 @@
+import os
+import json
+import queue
+import signal
+import threading
+import multiprocessing
+
+import config
+import AlertEngine
+from ClockSync import ClockSync
+from LogWriter import LogWriter
+from TimeSeriesStore import TimeSeriesStore
+
+#Pre-fork serving mode. N worker processes each bind the server port with SO_REUSEPORT, so the kernel spreads new
+#connections over them and every core runs its own interpreter. Workers never append to a file or the database
+#themselves: log lines and readings go through one multiprocessing queue to a single writer process, which owns the
+#LogWriters (ESP32.log and every board log), the TimeSeriesStore and the alert rules. Reads (/log, /log/tail, /series)
+#go straight to the files and the WAL database, which is safe alongside the one writer.
+#The parent process only supervises: it restarts workers that die and, on SIGINT or SIGTERM, stops the workers
+#first and then lets the writer drain the queue before it exits.
+
+#Queue from the workers to the writer, created by serve() before the processes are forked
+records = None
+
+#Stand-in for a LogWriter in a worker process. Lines are queued for the writer process, which owns the file
+class QueuedLog:
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, line):
+        self.writeMany((line,))
+
+    def writeMany(self, lines):
+        records.put(('log', self.path, list(lines)))
+
+    #The writer flushes every config.LOG_FLUSH_INTERVAL seconds, a worker cannot force it
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+#Stand-in for the TimeSeriesStore in a worker process. Readings are queued for the writer process (which also runs
+#them through the alert rules), queries use a connection of this worker's own, opened on first use
+class QueuedStore:
+
+    def __init__(self, path=config.TS_DB_FILE_NAME):
+        self.path = path
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def add(self, series, ts, value):
+        self.addMany(((series, ts, value),))
+
+    def addMany(self, readings):
+        records.put(('readings', list(readings)))
+
+    def _store(self):
+        if(self._reader is None):
+            with self._lock:
+                if(self._reader is None):
+                    self._reader = TimeSeriesStore(self.path)
+        return self._reader
+
+    def query(self, series, start, end, resolution='hour'):
+        return self._store().query(series, start, end, resolution)
+
+    def seriesNames(self):
+        return self._store().seriesNames()
+
+    def close(self):
+        if(self._reader is not None):
+            self._reader.close()
+
+#Stand-in for the AlertEngine in a worker process. The rules run in the writer process, which writes the engine's
+#status to config.PREFORK_ALERT_STATUS_FILE whenever an alert changes state
+class AlertStatus:
+
+    def __init__(self, path=config.PREFORK_ALERT_STATUS_FILE):
+        self.path = path
+
+    def observe(self, readings):
+        pass
+
+    def status(self):
+        try:
+            with open(self.path) as statusFile:
+                return json.load(statusFile)
+        except (OSError, ValueError):
+            return {'active': [], 'recent': []}
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+#The single writer process. Takes up to config.PREFORK_WRITER_BATCH records per pass so the readings of many
+#requests are stored (and evaluated) in one transaction
+class RecordWriter:
+
+    def __init__(self, records, batchSize=config.PREFORK_WRITER_BATCH, statusPath=config.PREFORK_ALERT_STATUS_FILE):
+        self.records = records
+        self.batchSize = batchSize
+        self.statusPath = statusPath
+        self.clock = ClockSync()
+        self.logs = {}
+        self.store = TimeSeriesStore()
+        self.alertsChanged = False
+        self.engine = AlertEngine.AlertEngine(AlertEngine.buildRules(config.ALERT_RULES), AlertEngine.createNotifier(), self.logAlert)
+
+    def log(self, path):
+        writer = self.logs.get(path)
+        if(writer is None):
+            writer = self.logs[path] = LogWriter(path)
+        return writer
+
+    def logAlert(self, epoch, message):
+        self.log(config.ESP32LOG_FILE_NAME).write(self.clock.timestamp(epoch)+message)
+        self.alertsChanged = True
+
+    #Method to replace the status file in one step so /alerts never reads a half written file
+    def writeAlertStatus(self):
+        self.alertsChanged = False
+        temporary = self.statusPath+".tmp"
+        with open(temporary, 'w') as statusFile:
+            json.dump(self.engine.status(), statusFile)
+        os.replace(temporary, self.statusPath)
+
+    #Method to apply one batch of records, log lines in the order they were queued. Returns False once the stop
+    #sentinel has been seen
+    def apply(self, batch):
+        readings = []
+        for record in batch:
+            if(record is None):
+                break
+            if(record[0]=='log'):
+                self.log(record[1]).writeMany(record[2])
+            elif(record[0]=='readings'):
+                readings.extend(record[1])
+        if(readings):
+            self.store.addMany(readings)
+            self.engine.observe(readings)
+        return None not in batch
+
+    def run(self):
+        #Stopping is the parent's call, it sends the sentinel once the workers are gone
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        self.clock.start()
+        self.engine.start()
+        running = True
+        while running:
+            try:
+                batch = [self.records.get(timeout=1)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch)<self.batchSize and batch[-1] is not None:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            if(batch):
+                running = self.apply(batch)
+            #Also checked when idle, silence alerts fire from the engine's timer
+            if(self.alertsChanged):
+                self.writeAlertStatus()
+        self.engine.stop()
+        if(self.alertsChanged):
+            self.writeAlertStatus()
+        for writer in self.logs.values():
+            writer.close()
+        self.store.close()
+        self.clock.stop()
+
+def _runWriter():
+    RecordWriter(records).run()
+
+def _runWorker(worker, index):
+    #Ctrl+C reaches the whole process group, the parent decides how the workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker(index)
+
+#Method to run the pre-fork server until SIGINT or SIGTERM. worker(index) serves requests in a worker process and
+#returns once the worker has been sent SIGTERM and has finished its requests
+def serve(worker, workers=config.PREFORK_WORKERS):
+    global records
+    context = multiprocessing.get_context('fork')
+    records = context.Queue(config.PREFORK_QUEUE_SIZE)
+    writer = context.Process(target=_runWriter, name="record-writer")
+    writer.start()
+    children = {}
+    for index in range(workers):
+        children[index] = context.Process(target=_runWorker, args=(worker, index), name="http-worker-{}".format(index))
+        children[index].start()
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    while not stopping.wait(1):
+        for index, child in list(children.items()):
+            if(not child.is_alive()):
+                print("Worker {} exited with code {}, restarting".format(index, child.exitcode))
+                children[index] = context.Process(target=_runWorker, args=(worker, index), name="http-worker-{}".format(index))
+                children[index].start()
+        if(not writer.is_alive()):
+            print("Writer process exited with code {}, stopping".format(writer.exitcode))
+            break
+
+    for child in children.values():
+        child.terminate()
+    for child in children.values():
+        child.join(config.PREFORK_SHUTDOWN_TIMEOUT)
+        if(child.is_alive()):
+            child.kill()
+    if(writer.is_alive()):
+        records.put(None)
+        writer.join(config.PREFORK_SHUTDOWN_TIMEOUT)
+        if(writer.is_alive()):
+            print("Writer process did not drain the queue within {}s".format(config.PREFORK_SHUTDOWN_TIMEOUT))
+            writer.kill()
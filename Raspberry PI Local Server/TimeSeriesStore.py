@@ -0,0 +1,103 @@
+import time
+import sqlite3
+import threading
+
+import config
+
+#Rollup resolutions kept for every series, in seconds
+RESOLUTIONS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+#SQLite (WAL mode) store for sensor and weather readings. Raw readings are appended to one table and every insert
+#also updates the minute, hour and day rollups (count, sum, min, max per bucket), so range queries read the rollup
+#rows for the requested resolution and never scan raw data. Raw readings and minute rollups are pruned after
+#config.TS_RAW_RETENTION and config.TS_MINUTE_RETENTION seconds, hour and day rollups are kept.
+class TimeSeriesStore:
+
+    def __init__(self, path=config.TS_DB_FILE_NAME, rawRetention=config.TS_RAW_RETENTION,
+                 minuteRetention=config.TS_MINUTE_RETENTION, pruneInterval=config.TS_PRUNE_INTERVAL):
+        self.path = path
+        self.rawRetention = rawRetention
+        self.minuteRetention = minuteRetention
+        self.pruneInterval = pruneInterval
+        #Buckets are aligned to local midnight rather than UTC so day rollups match the log's dates
+        self.bucketOffset = time.localtime().tm_gmtoff
+        self._lock = threading.Lock()
+        self._lastPrune = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS readings (
+                series TEXT NOT NULL,
+                ts REAL NOT NULL,
+                value REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS readings_series_ts ON readings (series, ts);
+            CREATE TABLE IF NOT EXISTS rollups (
+                series TEXT NOT NULL,
+                resolution INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                total REAL NOT NULL,
+                min REAL NOT NULL,
+                max REAL NOT NULL,
+                PRIMARY KEY (series, resolution, bucket)
+            ) WITHOUT ROWID;
+        ''')
+
+    def bucket(self, ts, resolution):
+        return int((ts+self.bucketOffset)//resolution*resolution-self.bucketOffset)
+
+    def add(self, series, ts, value):
+        self.addMany(((series, ts, value),))
+
+    #Method to store several (series, timestamp, value) readings in one transaction
+    def addMany(self, readings):
+        readings = list(readings)
+        rows = []
+        for series, ts, value in readings:
+            for resolution in RESOLUTIONS.values():
+                rows.append((series, resolution, self.bucket(ts, resolution), value, value, value))
+        with self._lock:
+            with self._db:
+                self._db.executemany("INSERT INTO readings (series, ts, value) VALUES (?, ?, ?)", readings)
+                self._db.executemany('''
+                    INSERT INTO rollups (series, resolution, bucket, count, total, min, max) VALUES (?, ?, ?, 1, ?, ?, ?)
+                    ON CONFLICT (series, resolution, bucket) DO UPDATE SET
+                        count = count+1, total = total+excluded.total,
+                        min = MIN(min, excluded.min), max = MAX(max, excluded.max)
+                ''', rows)
+            if(time.time()-self._lastPrune>=self.pruneInterval):
+                self._prune()
+
+    def _prune(self):
+        now = time.time()
+        with self._db:
+            if(self.rawRetention):
+                self._db.execute("DELETE FROM readings WHERE ts < ?", (now-self.rawRetention,))
+            if(self.minuteRetention):
+                self._db.execute("DELETE FROM rollups WHERE resolution = ? AND bucket < ?",
+                                 (RESOLUTIONS['minute'], now-self.minuteRetention))
+        self._lastPrune = now
+
+    #Method to read rollups for one series. Returns [bucket start, count, mean, min, max] rows in time order
+    def query(self, series, start, end, resolution='hour'):
+        if(resolution not in RESOLUTIONS):
+            raise ValueError("resolution must be one of {}".format(", ".join(RESOLUTIONS)))
+        seconds = RESOLUTIONS[resolution]
+        with self._lock:
+            rows = self._db.execute('''
+                SELECT bucket, count, total, min, max FROM rollups
+                WHERE series = ? AND resolution = ? AND bucket >= ? AND bucket <= ?
+                ORDER BY bucket
+            ''', (series, seconds, self.bucket(start, seconds), end)).fetchall()
+        return [[bucket, count, total/count, low, high] for bucket, count, total, low, high in rows]
+
+    def seriesNames(self):
+        with self._lock:
+            rows = self._db.execute("SELECT DISTINCT series FROM rollups WHERE resolution = ?", (RESOLUTIONS['day'],)).fetchall()
+        return sorted(row[0] for row in rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,79 @@
+import time
+import threading
+import requests
+
+import config
+
+#Raised when an upstream API cannot be reached or answers with an error and there is no cached value to fall back on
+class UpstreamError(Exception):
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+#In-memory cache shared by every board. Values are fetched at most once per ttl seconds, concurrent misses for the
+#same key wait for a single upstream call, and a failed refresh keeps serving the old value for up to staleTTL seconds
+class TTLCache:
+
+    def __init__(self, ttl, staleTTL=0):
+        self.ttl = ttl
+        self.staleTTL = staleTTL
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._fetchLocks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, fetch):
+        entry = self._entries.get(key)
+        if(entry is not None and time.monotonic()-entry[0]<self.ttl):
+            self.hits += 1
+            return entry[1]
+        with self._lock:
+            fetchLock = self._fetchLocks.setdefault(key, threading.Lock())
+        with fetchLock:
+            #Another thread may have refreshed the entry while this one waited
+            entry = self._entries.get(key)
+            if(entry is not None and time.monotonic()-entry[0]<self.ttl):
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            try:
+                value = fetch()
+            except UpstreamError:
+                if(entry is not None and time.monotonic()-entry[0]<self.ttl+self.staleTTL):
+                    return entry[1]
+                raise
+            self._entries[key] = (time.monotonic(), value)
+            return value
+
+cache = TTLCache(config.WEATHER_CACHE_TTL, config.WEATHER_STALE_TTL)
+
+#Method to fetch current weather from OpenWeather and keep only what the ESP32 displays.
+#Returns (temperature in C, humidity in %, pressure in bar, report)
+def fetchWeather():
+    try:
+        response = requests.get(config.OPENWEATHER_BASE_API_URL,
+                                params={'q': config.OPENWEATHER_CITYNAME, 'appid': config.OPENWEATHER_APPID},
+                                timeout=config.UPSTREAM_TIMEOUT)
+    except requests.RequestException as e:
+        raise UpstreamError(504, "OpenWeather unreachable: {}".format(e))
+    if(response.status_code!=200):
+        raise UpstreamError(response.status_code, "OpenWeather returned status code {}".format(response.status_code))
+    #A 200 with an unexpected body is an upstream failure too, so the cache can fall back on the last good value
+    try:
+        weatherData = response.json()
+        tempHumPre = weatherData['main']
+        report = weatherData['weather'][0]['description']
+        return (round(tempHumPre['temp']-273.15, 1), tempHumPre['humidity'], round(tempHumPre['pressure']*0.001, 3),
+                report[0].upper()+report[1:])
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise UpstreamError(502, "Unexpected OpenWeather response: {!r}".format(e))
+
+def currentWeather():
+    return cache.get('weather', fetchWeather)
+
+#Fixed layout payload for the ESP32: 'temperature|humidity|pressure|report', so the board can split it without a JSON parser
+def weatherPayload():
+    temp, hum, pressure, report = currentWeather()
+    return "{}|{}|{}|{}".format(temp, hum, pressure, report.replace("|", "/")).encode("utf-8")
@@ -1,6 +1,115 @@
 HOST_NAME = ''  # IP Address of Raspberry Pi
-HOST_PORT = 
+HOST_PORT = 8000
 WEB_SERVER_VERSION = '1.0.0'
 ESP32LOG_FILE_NAME = 'ESP32.log'
 WORLDTIMEAPI_URL = 'https://worldtimeapi.org/api/timezone/Asia/Kolkata'
 RELAYSTATEMSG ='Switched Relay State for Virtual Pin {} Digital Pin {} to {}'
+
+# Request handling
+SERVER_MODE = 'pool'  # 'pool' (fixed worker threads), 'threaded' (one thread per request), 'single' or 'prefork' (worker processes, see below)
+SERVER_WORKERS = 8  # Number of worker threads in 'pool' mode, per process in 'prefork' mode. Only busy requests hold one, idle boards do not
+SERVER_QUEUE_SIZE = 64  # Requests waiting for a free worker before new ones are refused. At least DEVICE_MAX so every board can have one waiting
+SERVER_LISTEN_BACKLOG = 128  # Connections the kernel holds until they are accepted. Above DEVICE_MAX so all boards can reconnect at once after a power cut
+SERVER_QUEUE_TIMEOUT = 2  # Seconds to wait for a queue slot before answering 503
+
+# Clock sync (WorldTimeAPI is only asked for the offset, log timestamps come from the local monotonic clock)
+CLOCK_RESYNC_INTERVAL = 3600  # Seconds between background resyncs
+CLOCK_RETRY_INTERVAL = 60  # Seconds before retrying after a failed sync
+CLOCK_STALE_AFTER = 21600  # Clock is reported stale when the last successful sync is older than this
+CLOCK_SYNC_TIMEOUT = 5  # Seconds to wait for WorldTimeAPI
+
+# ESP32 log writer
+LOG_BATCH_SIZE = 64  # Lines buffered before the writer thread flushes early
+LOG_FLUSH_INTERVAL = 2  # Seconds between flushes when traffic is light
+LOG_MAX_PENDING = 4096  # Handlers wait when this many lines are still unwritten
+LOG_FSYNC_POLICY = 'interval'  # 'never' (leave it to the OS), 'batch' (after every flush) or 'interval'
+LOG_FSYNC_INTERVAL = 30  # Seconds between fsyncs with the 'interval' policy
+LOG_ROTATE_MAX_BYTES = 5*1024*1024  # Rotate when the log reaches this size, 0 to disable
+LOG_ROTATE_INTERVAL = 0  # Rotate when the log is older than this many seconds, 0 to disable
+LOG_ROTATE_BACKUP_COUNT = 10  # Rotated segments kept as ESP32.log.1 .. ESP32.log.N
+LOG_ROTATE_COMPRESS = True  # Gzip rotated segments
+
+# Request bodies
+MAX_BODY_BYTES = 16384  # Larger JSON bodies are refused with 413
+
+# Relays
+RELAY_GPIO_PINS = (12, 13, 14, 15, 21, 23, 25, 26)  # ESP32 digital pin for relays on V0-V7, must match constant.py on the ESP32
+
+# Event codes used by the ESP32 in /ingest batches. Must match EVENT_* in the ESP32's constant.py
+EVENT_BLYNK_CONNECTED = 0
+EVENT_BLYNK_DISCONNECTED = 1
+EVENT_RELAY = 2
+EVENT_RELAY_SCENE = 3
+EVENT_DHT_SUCCESS = 4
+EVENT_DHT_FAIL = 5
+EVENT_WEATHER_SUCCESS = 6
+EVENT_WEATHER_FAIL = 7
+EVENT_EMAIL_SUCCESS = 8
+EVENT_EMAIL_FAIL = 9
+EVENT_DHT_SUMMARY = 10
+
+# Keep-alive
+KEEPALIVE_TIMEOUT = 330  # Seconds an idle keep-alive connection is kept open. Longer than the boards' longest report interval (HEARTBEAT_INTERVAL, 300 s) so reports reuse it. Idle connections hold no worker in 'pool' mode, one thread each in 'threaded' mode
+REQUEST_TIMEOUT = 5  # Seconds a client may stall while sending a request or reading a response before its connection is dropped
+
+# Time-series store for DHT and weather readings
+TS_DB_FILE_NAME = 'readings.db'  # SQLite database, WAL mode
+TS_RAW_RETENTION = 7*86400  # Seconds raw readings are kept, 0 to keep forever
+TS_MINUTE_RETENTION = 30*86400  # Seconds minute rollups are kept, 0 to keep forever. Hour and day rollups are always kept
+TS_PRUNE_INTERVAL = 3600  # Seconds between pruning passes
+
+# ESP32.log query and tail endpoints
+LOG_INDEX_STRIDE = 65536  # Bytes between sparse index entries
+LOG_INDEX_SLACK = 300  # Seconds of out of order lines tolerated around a range boundary (batched ESP32 events are logged with their own time)
+LOG_STREAM_CHUNK = 16384  # Bytes per streamed response chunk
+LOG_TAIL_MAX_LINES = 1000  # Most lines /log/tail returns
+LOG_TAIL_POLL_INTERVAL = 1  # Seconds between checks for new lines when following
+LOG_TAIL_MAX_SECONDS = 600  # Longest a follow request stays open. It holds a worker thread the whole time
+LOG_TAIL_MAX_FOLLOWERS = 2  # Follow requests streaming at once (per process in 'prefork' mode), at most a quarter of SERVER_WORKERS. Refused with 503 beyond it, always in 'single' mode
+
+# OpenWeather gateway (/weather) shared by all boards
+OPENWEATHER_APPID = ''
+OPENWEATHER_CITYNAME = 'navi mumbai'
+OPENWEATHER_BASE_API_URL = 'https://api.openweathermap.org/data/2.5/weather'
+WEATHER_CACHE_TTL = 600  # Seconds a fetched weather report is served before OpenWeather is asked again
+WEATHER_STALE_TTL = 3600  # Extra seconds an old report is served while OpenWeather is failing
+UPSTREAM_TIMEOUT = 10  # Seconds to wait for OpenWeather
+
+# ESP32 heartbeats (/heartbeat)
+HEARTBEAT_HISTORY = 288  # Heartbeats kept in memory per board for /heartbeats (one day at the ESP32's 5 minute interval)
+HEARTBEAT_FIELDS = ('free', 'alloc', 'largest', 'rssi', 'pi_conn', 'pi_fail', 'blynk_conn', 'dropped', 'jobs_dropped')  # Numeric heartbeat fields, all required
+
+# Alert rules evaluated over incoming readings (see AlertEngine.py). 'series' is a name listed on /series without the
+# '<device id>/' prefix. Rules apply to every board unless they set 'device'
+ALERT_RULES = [
+    {'name': 'high_temperature', 'type': 'threshold', 'series': 'dht.temperature', 'above': 40, 'clear': 38},  # Replaces the ESP32's temperature>40 IFTTT call
+    {'name': 'temperature_rising', 'type': 'rate', 'series': 'dht.temperature', 'change': 5, 'window': 900},
+    {'name': 'dht_silent', 'type': 'silence', 'series': 'dht.temperature', 'timeout': 7200},
+]
+ALERT_DEFAULT_COOLDOWN = 1800  # Seconds after a notification before the same rule may notify again, unless the rule sets 'cooldown'
+ALERT_CHECK_INTERVAL = 60  # Seconds between checks for silent sensors
+ALERT_QUEUE_SIZE = 64  # Alerts waiting for the notifier before new ones are dropped
+ALERT_HISTORY = 200  # Recent alerts listed on /alerts
+ALERT_NOTIFIER = 'ifttt'  # 'ifttt', 'http' (POST the alert as JSON to ALERT_HTTP_URL, e.g. a local stub) or 'log' (print only)
+ALERT_IFTTT_URL = 'https://maker.ifttt.com/trigger/{event}/with/key/{key}'
+ALERT_IFTTT_KEY = ''
+ALERT_IFTTT_EVENT = 'DHT22_TempTooHigh'
+ALERT_HTTP_URL = 'http://127.0.0.1:9000/alert'
+
+# Boards (see DeviceRegistry.py). Each board sends its ID in an X-Device-ID header
+DEVICE_LOG_DIR = 'devices'  # Directory for the per-board logs, <device id>.log
+DEVICE_MAX = 64  # Most boards registered at once. Each keeps an open log file and a writer thread. Raise SERVER_QUEUE_SIZE and SERVER_LISTEN_BACKLOG with it
+
+# Live event stream for dashboards (/events, Server-Sent Events)
+SSE_MAX_CLIENTS = 32  # Dashboards connected at once. Streams are written by one background thread and do not hold HTTP workers
+SSE_CLIENT_BUFFER = 65536  # Bytes queued for one dashboard before it is dropped as too slow
+SSE_KEEPALIVE_INTERVAL = 15  # Seconds between keepalive comments on idle streams
+
+# Pre-fork mode (SERVER_MODE = 'prefork'). Worker processes share the port with SO_REUSEPORT and one writer process
+# owns the logs, the reading store and the alert rules. The device registry, heartbeat history, /events and /metrics
+# are kept per worker, so they only show the boards whose connections that worker happened to accept
+PREFORK_WORKERS = 4  # Worker processes, one per core
+PREFORK_QUEUE_SIZE = 10000  # Records (log line batches, readings) waiting for the writer before workers block
+PREFORK_WRITER_BATCH = 256  # Records the writer takes per pass, their readings are stored in one transaction
+PREFORK_SHUTDOWN_TIMEOUT = 10  # Seconds workers get to finish requests, then the writer to drain the queue
+PREFORK_ALERT_STATUS_FILE = 'alerts.json'  # Alert status written by the writer process and served by /alerts